@@ -13,6 +13,7 @@ from flask_login import LoginManager
 from flask_mongoengine import MongoEngine
 
 import app.constants as c
+from app.jobs import start_threads
 from app.models.users import query_user
 
 
@@ -113,9 +114,9 @@ def create_app(logging=True, log_level: str | None = None):
         application.register_blueprint(blueprint_stats)
         application.register_blueprint(blueprint_admin)
 
-        from app.blueprints.main import render_display_column
+        from app.blueprints.main import render_display_column, render_row
 
-        application.jinja_env.globals.update(render_display_column=render_display_column)
+        application.jinja_env.globals.update(render_display_column=render_display_column, render_row=render_row)
 
         log.debug("...registered blueprints")
 
@@ -130,5 +131,10 @@ def create_app(logging=True, log_level: str | None = None):
 
         log.debug("...defined context processors")
 
+        ################################################################################
+        # Start our background job threads (unless jobs are only run by "poe worker")
+        ################################################################################
+        start_threads(application)
+
         log.debug("setup done, ready to go!...")
     return application
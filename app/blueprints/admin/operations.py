@@ -1,12 +1,16 @@
 """Source Management Operations."""
 
+import datetime as dt
 import logging as log
 from collections import defaultdict
 
 from mongoengine.context_managers import switch_collection
 
+from app.blueprints.main.search_index import reindex_documents
 from app.models.documents import Documents
 from app.models.users import Users
+from app.models.versions import bump_version
+from app.models.vocabularies import refresh_vocabulary
 
 
 ################################################################################
@@ -35,7 +39,12 @@ def remove_source(user: Users, source: str) -> int:
     """Remove specified source from all documents."""
     log.debug(f"Removing {source=}")
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        return user_documents.objects(source=source).update(source=None)
+        ids = [doc.id for doc in user_documents.objects(source=source).only("id")]
+        count = user_documents.objects(id__in=ids).update(source=None, updated=dt.datetime.utcnow())
+    bump_version(Documents.as_user(user))
+    refresh_vocabulary(Documents.as_user(user), {"source": {source}}, None)
+    reindex_documents(user, ids)
+    return count
 
 
 def update_source(user: Users, old: str, new: str) -> int:
@@ -43,7 +52,11 @@ def update_source(user: Users, old: str, new: str) -> int:
     log.debug(f"Updating {old=} {new=}")
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
         ids = [doc.id for doc in user_documents.objects(source=old).only("id")]
-        return user_documents.objects(id__in=ids).update(source=new)
+        count = user_documents.objects(id__in=ids).update(source=new, updated=dt.datetime.utcnow())
+    bump_version(Documents.as_user(user))
+    refresh_vocabulary(Documents.as_user(user), {"source": {old}}, {"source": {new}})
+    reindex_documents(user, ids)
+    return count
 
 
 ################################################################################
@@ -72,7 +85,13 @@ def remove_tag(user: Users, tag: str) -> int:
     """Remove specified tag from all documents."""
     log.debug(f"Removing {tag=}")
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        return user_documents.objects(tags__in=[tag]).update(pull__tags=tag)
+        ids = [doc.id for doc in user_documents.objects(tags__in=[tag]).only("id")]
+        count = user_documents.objects(id__in=ids).update(pull__tags=tag, updated=dt.datetime.utcnow())
+        user_documents.update_derived_fields({"_id": {"$in": ids}})
+    bump_version(Documents.as_user(user))
+    refresh_vocabulary(Documents.as_user(user), {"tags": {tag}}, None)
+    reindex_documents(user, ids)
+    return count
 
 
 def update_tag(user: Users, old: str, new: str) -> int:
@@ -81,9 +100,13 @@ def update_tag(user: Users, old: str, new: str) -> int:
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
         ids = [doc.id for doc in user_documents.objects(tags__in=[old]).only("id")]
         count_pulled = user_documents.objects(id__in=ids).update(pull__tags=old)
-        count_pushed = user_documents.objects(id__in=ids).update(push__tags=new)
+        count_pushed = user_documents.objects(id__in=ids).update(push__tags=new, updated=dt.datetime.utcnow())
         if count_pulled != count_pushed:
             msg = f"Sorry, we 'should' have pulled {count_pulled=} as many document as we pushed {count_pushed=}"
             log.error(msg)
+        user_documents.update_derived_fields({"_id": {"$in": ids}})
 
+    bump_version(Documents.as_user(user))
+    refresh_vocabulary(Documents.as_user(user), {"tags": {old}}, {"tags": {new}})
+    reindex_documents(user, ids)
     return count_pushed
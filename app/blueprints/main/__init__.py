@@ -2,40 +2,72 @@
 
 import logging as log
 
-from flask import Blueprint
+import flask_login as fl
+from flask import Blueprint, render_template
+from markupsafe import Markup
 
 bp = Blueprint("main", __name__, template_folder="main")
 
 import app.blueprints.main.routes
+import app.constants as c
+from app.cache import LRUCache
 from app.models import Category
+from app.models.documents import DocumentRow
+
+# fmt: off
+DISPLAY_FIELDS = {
+    Category.COOKING_RECIPES: {
+        "complexity"            : True,
+        "edit"                  : True,
+        "times_cooked"           : True,
+        "quality"               : True,
+        "quality_by_complexity" : True,
+        "source"                : True,
+        "tags"                  : True,
+        "title"                 : True,
+    },
+    "default": { # All other categories..
+        "complexity"            : False,
+        "edit"                  : True,
+        "times_cooked"           : False,
+        "quality"               : False,
+        "quality_by_complexity" : False,
+        "source"                : True,
+        "tags"                  : True,
+        "title"                 : True,
+    },
+}
+# fmt: on
 
 
 def render_display_column(category: Category, field: str) -> bool:
-    # fmt: off
-    display_fields = {
-        Category.COOKING_RECIPES: {
-            "complexity"            : True,
-            "edit"                  : True,
-            "times_cooked"           : True,
-            "quality"               : True,
-            "quality_by_complexity" : True,
-            "source"                : True,
-            "tags"                  : True,
-            "title"                 : True,
-        },
-        "default": { # All other categories..
-            "complexity"            : False,
-            "edit"                  : True,
-            "times_cooked"           : False,
-            "quality"               : False,
-            "quality_by_complexity" : False,
-            "source"                : True,
-            "tags"                  : True,
-            "title"                 : True,
-        },
-    }
-    # fmt: on
-
-    l_fields = display_fields.get(category, display_fields["default"])
+    l_fields = DISPLAY_FIELDS.get(category, DISPLAY_FIELDS["default"])
     assert field in l_fields
     return l_fields.get(field)
+
+
+def display_columns(category: Category) -> tuple[str, ...]:
+    """Return the (sorted) set of columns displayed for the category specified."""
+    l_fields = DISPLAY_FIELDS.get(category, DISPLAY_FIELDS["default"])
+    return tuple(sorted(field for field, display in l_fields.items() if display))
+
+
+################################################################################
+# Main table rows, rendered once per document "version" and cached thereafter.
+################################################################################
+ROW_TEMPLATE = "main/hx/display_table_tr.html"
+ROWS = LRUCache(c.ROW_CACHE_SIZE)
+
+
+def render_row(document: DocumentRow) -> Markup:
+    """Return the rendered table row for the document, ie. from our cache unless it's changed since last rendered.
+
+    Rows are keyed by document id, last update and the columns displayed for the user's category,
+    hence *all* writes to a document must also set its "updated" timestamp (including those of its
+    derived fields, see Documents.update_derived_fields).
+    """
+    key = (document.id, document.updated, display_columns(fl.current_user.category))
+    if (row := ROWS.get(key)) is None:
+        row = Markup(render_template(ROW_TEMPLATE, document=document))
+        ROWS.put(key, row)
+    return row
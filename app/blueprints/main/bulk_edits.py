@@ -0,0 +1,184 @@
+"""Bulk edits, ie. the same change(s) to many documents at once (eg. retagging the results of a search).
+
+Rather than an edit (and round-trip) per document, the documents are read once (just the fields
+concerned, ie. to know which documents each change actually applies to) and written with a single
+(unordered) bulk_write of one update per document changed, reporting the outcome for each.
+
+Changes are written as idempotent update pipelines (eg. a tag is only added if it's not already
+there), such that a document edited elsewhere between our read and write still ends up correct.
+"""
+
+import logging as log
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+from bson.objectid import ObjectId
+from mongoengine.context_managers import switch_collection
+from mongoengine.errors import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from werkzeug.exceptions import BadRequest
+
+from app.blueprints.main.search_index import reindex_documents
+from app.models import Category
+from app.models.documents import DERIVED_FIELDS, Documents
+from app.models.users import Users
+from app.models.versions import bump_version
+from app.models.vocabularies import refresh_vocabulary
+
+# Outcomes for each document
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+NOT_FOUND = "not found"
+FAILED = "failed"
+
+# fmt: off
+# Operations supported and the document field each changes.
+OPERATIONS = {
+    "add_tag"         : "tags",
+    "remove_tag"      : "tags",
+    "set_source"      : "source",
+    "set_quality"     : "quality",
+    "set_complexity"  : "complexity",
+    "add_date_cooked" : "dates_cooked",
+}
+# Derived fields (see DERIVED_FIELDS) depending on each field changed.
+DERIVED = {
+    "tags"            : ("tags_for_sort",),
+    "quality"         : ("quality_by_complexity",),
+    "complexity"      : ("quality_by_complexity",),
+    "dates_cooked"    : ("times_cooked",),
+}
+# fmt: on
+
+
+@dataclass
+class BulkOperation:
+    """A single change to be applied to each document, eg. add the tag "Quick"."""
+
+    name: str
+    value: Any
+
+    @property
+    def field(self) -> str:
+        return OPERATIONS[self.name]
+
+    def applies(self, son: dict) -> bool:
+        """Return True if this operation would change the document specified (ie. as read from the database)."""
+        current = son.get(self.field)
+        match self.name:
+            case "add_tag" | "add_date_cooked":
+                return self.value not in (current or [])
+            case "remove_tag":
+                return self.value in (current or [])
+        return current != self.value
+
+    def expression(self) -> dict:
+        """Return the expression of the field's new value in an update pipeline (no-op if it doesn't apply)."""
+        array = {"$ifNull": [f"${self.field}", []]}
+        value = {"$literal": self.value}
+        match self.name:
+            case "add_tag":
+                appended = {"$sortArray": {"input": {"$concatArrays": [array, [value]]}, "sortBy": 1}}
+                return {"$cond": [{"$in": [value, array]}, array, appended]}
+            case "add_date_cooked":
+                return {"$cond": [{"$in": [value, array]}, array, {"$concatArrays": [array, [value]]}]}
+            case "remove_tag":
+                return {"$filter": {"input": array, "cond": {"$ne": ["$$this", value]}}}
+        return value
+
+
+def parse_operations(specs: list[dict]) -> list[BulkOperation]:
+    """Return the operations specified, eg. [{"op": "add_tag", "value": "quick"}, {"op": "set_quality", "value": 4}]."""
+    if not specs or not isinstance(specs, list):
+        raise BadRequest("Sorry, at least one operation is required.")
+    if not all(isinstance(spec, dict) for spec in specs):
+        raise BadRequest('Sorry, each operation should be an object, eg. {"op": "add_tag", "value": "quick"}.')
+    return [parse_operation(spec.get("op"), spec.get("value")) for spec in specs]
+
+
+def parse_ids(ids: list[str]) -> list[str]:
+    """Return the document ids specified, ie. a list of ObjectId strings."""
+    if not isinstance(ids, list) or not all(isinstance(id_, str) and ObjectId.is_valid(id_) for id_ in ids):
+        raise BadRequest("Sorry, ids should be a list of document ids.")
+    return ids
+
+
+def parse_operation(name: str, value: Any) -> BulkOperation:
+    """Return the operation specified with its value validated/converted as per the field it changes."""
+    if name not in OPERATIONS:
+        raise BadRequest(f"Sorry, unrecognised operation: '{name}' (should be one of {', '.join(OPERATIONS)})")
+    try:
+        match name:
+            case "add_tag" | "remove_tag":
+                if not (value := str(value or "").strip()):
+                    raise ValueError("a tag is required")
+                value = value.title()  # (ie. as tags are stored)
+                Documents._fields["tags"].field.validate(value)
+            case "set_source":
+                value = str(value or "").strip() or None
+            case "set_quality" | "set_complexity":
+                value = int(value) if value not in (None, "") else None
+                if value is not None:
+                    Documents._fields[OPERATIONS[name]].validate(value)
+            case "add_date_cooked":
+                value = datetime.strptime(str(value), "%Y-%m-%d")
+    except (TypeError, ValueError, ValidationError) as exc:
+        raise BadRequest(f"Sorry, invalid value for {name}: '{value}' ({exc})") from exc
+    return BulkOperation(name, value)
+
+
+def bulk_edit(
+    user: Users,
+    ids: list[str],
+    operations: list[BulkOperation],
+    category: Category | None = None,
+) -> dict[str, str]:
+    """Apply the operations to each of the user's documents specified, returning the outcome for each (by id)."""
+    collection = Documents.as_user(user, category)
+    outcomes = dict.fromkeys(ids, NOT_FOUND)
+    object_ids = [ObjectId(id_) for id_ in outcomes if ObjectId.is_valid(id_)]
+    projection = dict.fromkeys({operation.field for operation in operations}, 1)
+    now = datetime.utcnow()
+
+    updates, changed, terms = [], [], {"tags": set(), "source": set()}
+    with switch_collection(Documents, collection) as user_documents:
+        documents = user_documents._get_collection()
+        for son in documents.find({"_id": {"$in": object_ids}}, projection):
+            applicable = [operation for operation in operations if operation.applies(son)]
+            outcomes[str(son["_id"])] = UPDATED if applicable else UNCHANGED
+            if not applicable:
+                continue
+            for operation in applicable:
+                if operation.field == "tags":
+                    terms["tags"].add(operation.value)
+                elif operation.field == "source":
+                    terms["source"] |= {operation.value, son.get("source")} - {None}
+            updates.append(UpdateOne({"_id": son["_id"]}, _pipeline(applicable, now)))
+            changed.append(son["_id"])
+
+        if updates:
+            try:
+                documents.bulk_write(updates, ordered=False)
+            except BulkWriteError as exc:
+                for error in exc.details.get("writeErrors", []):
+                    outcomes[str(changed[error["index"]])] = f"{FAILED}: {error.get('errmsg')}"
+
+    if changed:
+        bump_version(collection)
+        refresh_vocabulary(collection, terms, None)
+        reindex_documents(user, changed, collection)
+    log.info(f"Bulk edit of {len(outcomes):,d} documents: {dict(Counter(outcomes.values()))}")
+    return outcomes
+
+
+def _pipeline(operations: list[BulkOperation], now: datetime) -> list[dict]:
+    """Return the update pipeline applying the operations in turn (and refreshing the derived fields affected)."""
+    pipeline = [{"$set": {operation.field: operation.expression()}} for operation in operations]
+    pipeline[0]["$set"]["updated"] = now
+    derived = {name for operation in operations for name in DERIVED.get(operation.field, ())}
+    if derived:
+        pipeline.append({"$set": {name: DERIVED_FIELDS[name] for name in sorted(derived)}})
+    return pipeline
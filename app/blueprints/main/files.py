@@ -0,0 +1,163 @@
+"""Serving of document files (ie. pdf's), including partial (ie. byte-range) and conditional requests.
+
+Files are served from a "source" (see app.storage), ie. whichever store holds it or our local copy.
+"""
+
+import secrets
+from collections.abc import Iterator
+
+from flask.wrappers import Request, Response
+from werkzeug.datastructures import Range
+from werkzeug.http import unquote_etag
+
+from app.storage.base import FileSource
+
+MAX_RANGES = 16  # Most ranges we'll serve in a single request (beyond which, we send the entire file instead).
+MAX_AGE_IMMUTABLE = 365 * 24 * 60 * 60  # Cache lifetime of a file requested by its key (which never changes)
+
+
+################################################################################
+# Responses
+################################################################################
+def send_stored_file(source: FileSource, download_name: str, request: Request) -> Response:
+    """Return a response streaming the file specified to the client, one chunk/block at a time.
+
+    Unlike a read() of the entire file, memory used per download stays at that of a single
+    chunk/block (~256KB), irrespective of the size of the file.
+
+    If the client asked for specific byte range(s) (eg. a pdf viewer loading page by page), we
+    only send those, seeking directly to the chunk(s) holding each.
+
+    Responses carry validators derived from the stored file itself (ie. any replacement of the file
+    changes them), such that clients can revalidate their copy with a 304 rather than a download.
+    If the request names the stored file (ie. ?v=<key>), the response can be cached by the client
+    for good (stored files are never changed, only replaced), otherwise it must always be
+    revalidated.
+    """
+    immutable = request.args.get("v") == source.key
+    if _is_not_modified(request, source):
+        source.close()
+        response = Response(status=304)
+        _set_validators(response, source, immutable)
+        return response
+
+    range_ = request.range if _is_range_current(request, source) else None
+    ranges = byte_ranges(range_, source.length) if range_ else None
+    if ranges == []:
+        source.close()
+        response = Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{source.length}"
+        return response
+
+    if ranges and len(ranges) == 1:
+        (start, stop) = ranges[0]
+        response = Response(
+            _close_after(source, source.read(start, stop - start)),
+            status=206,
+            mimetype=source.content_type,
+            direct_passthrough=True,
+        )
+        response.content_length = stop - start
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{source.length}"
+
+    elif ranges:
+        boundary = secrets.token_hex(16)
+        parts = [(_part_header(boundary, source, start, stop), start, stop) for start, stop in ranges]
+        trailer = f"\r\n--{boundary}--\r\n".encode()
+        response = Response(
+            _close_after(source, _iter_parts(source, parts, trailer)),
+            status=206,
+            mimetype=f"multipart/byteranges; boundary={boundary}",
+            direct_passthrough=True,
+        )
+        response.content_length = sum(len(header) + stop - start for header, start, stop in parts) + len(trailer)
+
+    else:
+        response = Response(source.body(request.environ), mimetype=source.content_type, direct_passthrough=True)
+        response.call_on_close(source.close)
+        response.content_length = source.length
+
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers.set("Content-Disposition", "inline", filename=download_name)
+    _set_validators(response, source, immutable)
+    return response
+
+
+def byte_ranges(range_: Range, length: int) -> list[tuple[int, int]] | None:
+    """Return the (start, stop) offsets satisfiable from the Range request for a file of the length specified.
+
+    Returns None if we should ignore the request and send the entire file instead (ie. unknown
+    units or too many ranges) and an empty list if *none* of the ranges can be satisfied.
+    """
+    if range_.units != "bytes" or len(range_.ranges) > MAX_RANGES:
+        return None
+    ranges = []
+    for first, last in range_.ranges:  # (werkzeug's are already stop-exclusive, ie. "bytes=0-99" -> (0, 100))
+        if first < 0:  # Suffix range, ie. the last -first bytes
+            start, stop = max(length + first, 0), length
+        else:
+            start, stop = first, length if last is None else min(last, length)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def _iter_parts(source: FileSource, parts: list[tuple[bytes, int, int]], trailer: bytes) -> Iterator[bytes]:
+    """Yield a multipart/byteranges body of the parts specified."""
+    for header, start, stop in parts:
+        yield header
+        yield from source.read(start, stop - start)
+    yield trailer
+
+
+def _part_header(boundary: str, source: FileSource, start: int, stop: int) -> bytes:
+    """Return the header of a single part of a multipart/byteranges body (including the preceding delimiter)."""
+    return (
+        f"\r\n--{boundary}\r\n"
+        f"Content-Type: {source.content_type}\r\n"
+        f"Content-Range: bytes {start}-{stop - 1}/{source.length}\r\n\r\n"
+    ).encode()
+
+
+def _is_not_modified(request: Request, source: FileSource) -> bool:
+    """Return True if the client already has the current version of the file (If-None-Match takes precedence)."""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains(source.version)
+    if request.if_modified_since:
+        return source.modified <= request.if_modified_since
+    return False
+
+
+def _is_range_current(request: Request, source: FileSource) -> bool:
+    """Return True if any range requested is of the current version of the file (ie. no If-Range or it matches)."""
+    if_range = request.if_range
+    if if_range.etag:
+        # (IfRange drops the etag's weakness, yet only a strong match will do, hence parse the header again for it)
+        _, weak = unquote_etag(request.headers.get("If-Range"))
+        return not weak and if_range.etag == source.version
+    if if_range.date:
+        # (RFC 7233 §3.2: a date only validates if it's an exact match for the current Last-Modified)
+        return source.modified == if_range.date.replace(microsecond=0)
+    return True
+
+
+def _set_validators(response: Response, source: FileSource, immutable: bool) -> None:
+    """Set the validators and caching policy of the response for the file specified."""
+    response.set_etag(source.version)
+    response.last_modified = source.modified
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.max_age = MAX_AGE_IMMUTABLE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+
+def _close_after(source: FileSource, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Yield from the chunks specified, closing the source when done (or if the client goes away)."""
+    try:
+        yield from chunks
+    finally:
+        source.close()
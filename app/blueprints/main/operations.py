@@ -1,78 +1,224 @@
 """Main/home view, essentially the master table itself, either all or from search."""
 
+import hashlib
 import logging as log
 import mimetypes
 import shlex
 import sys
 from collections.abc import Callable
+from dataclasses import dataclass, field
 from datetime import datetime
 from functools import reduce
+from operator import and_, or_
 
+from bson import json_util
 from bson.objectid import ObjectId
+from flask import current_app
 from mongoengine.context_managers import switch_collection
-from mongoengine.queryset.queryset import QuerySet
-from mongoengine.queryset.visitor import QCombination
+from mongoengine.errors import ValidationError
+from mongoengine.queryset.visitor import Q, QCombination
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from werkzeug.exceptions import BadRequest, NotFound
 from werkzeug.utils import secure_filename
-
-from app.models import Sort
-from app.models.documents import Documents
+from werkzeug.wrappers import Request
+
+import app.constants as c
+from app.blueprints.main.previews import request_thumbnail
+from app.blueprints.main.search_index import INDEX_FIELDS, INDICES, index_document, unindex_documents
+from app.blueprints.main.texts import delete_texts, request_text, search_texts
+from app.cache import LRUCache
+from app.models import Cursor, Sort
+from app.models.documents import DERIVED_FIELDS, BlobRef, DocumentRow, Documents
 from app.models.users import Users
+from app.models.versions import bump_version, get_version
+from app.models.vocabularies import document_terms, refresh_vocabulary
+from app.storage import STORE_GRIDFS, put_blob, put_document_file, release_blob, release_blobs
+
+# Slices of the main table (and search results) recently returned, keyed by collection *version* (see _listing_key),
+# ie. any write to a collection implicitly invalidates all its entries (which then simply age out).
+LISTINGS = LRUCache(c.LISTING_CACHE_SIZE)
+
+
+def get_page_documents(
+    user: Users,
+    cursor: Cursor,
+    query: dict | None = None,
+) -> tuple[list[DocumentRow], int | None, Cursor | None]:
+    """Return the "slice" of documents after the cursor (sorted in the database) and the cursor for the next one.
+
+    To maintain our semantic that "None" entries are always at the bottom irrespective of
+    sort order, we page across two "segments": first, those documents that
+    *have* a value for the sort field (sorted by the field in the requested direction) and
+    then those that don't (in natural/insertion order). Within each, we use the keyset of
+    (sort value, id) from the cursor, ie. we never skip/offset through the collection.
 
+    We only count the total number of documents matching on the very first slice (for the
+    table caption), on subsequent ones, None is returned instead. Similarly, the cursor
+    returned is None if there are no more documents to be rendered.
+
+    Results are cached by collection version, sort, position and query (see LISTINGS).
+    """
+    key = _listing_key(user, query, cursor.encode(), cursor.size)
+    if (cached := LISTINGS.get(key)) is not None:
+        log.debug(f"{len(cached[0]):,d} documents found in cache ({cursor}).")
+        return cached
+
+    query = query or {}
+    sort_field, sort_expression = _sort_field(cursor.sort, query)
+    direction = 1 if cursor.sort.is_ascending() else -1
+    operator = "$gt" if cursor.sort.is_ascending() else "$lt"
 
-def get_all_documents(user: Users, sort: Sort) -> tuple[list[Documents], dict]:
-    """Return *all* documents."""
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        documents = user_documents.objects()
-    log.debug(f"{len(documents):,d} documents found.")
-    return _sort(documents, sort)
+        collection = user_documents._get_collection()
+        total = collection.count_documents(query) if cursor.is_first() else None
+
+        # Note that we always ask for one more than we need in order to know if there's a "next" slice.
+        sons, segments = [], []
+        if cursor.segment == Cursor.POPULATED:
+            match = {sort_field: {"$ne": None}}
+            if cursor.id:
+                after_value = {sort_field: {operator: cursor.value}}
+                after_id = {sort_field: cursor.value, "_id": {operator: ObjectId(cursor.id)}}
+                match = {"$and": [match, {"$or": [after_value, after_id]}]}
+            order = {sort_field: direction, "_id": direction}
+            sons.extend(collection.aggregate(_sort_pipeline(sort_expression, query, match, order, cursor.size + 1)))
+            segments.extend([Cursor.POPULATED] * len(sons))
+
+        if len(sons) <= cursor.size:
+            match = {sort_field: None}
+            if cursor.segment == Cursor.EMPTY and cursor.id:
+                match["_id"] = {"$gt": ObjectId(cursor.id)}
+            limit = cursor.size + 1 - len(sons)
+            empties = list(collection.aggregate(_sort_pipeline(sort_expression, query, match, {"_id": 1}, limit)))
+            sons.extend(empties)
+            segments.extend([Cursor.EMPTY] * len(empties))
+
+        # Do we have more to render after this slice? If so, setup the cursor to get it:
+        cursor_next = None
+        if len(sons) > cursor.size:
+            sons, last, segment = sons[: cursor.size], sons[cursor.size - 1], segments[cursor.size - 1]
+            cursor_next = cursor.after(segment, last.get(sort_field), last["_id"])
+
+        documents = [DocumentRow(son) for son in sons]
+
+    log.debug(f"{len(documents):,d} documents found ({cursor}).")
+    LISTINGS.put(key, (documents, total, cursor_next))
+    return documents, total, cursor_next
+
+
+def get_document_ids(user: Users, query: dict | None = None) -> list[str]:
+    """Return the ids of *all* documents matching the query specified (without rendering them)."""
+    key = _listing_key(user, query, "ids")
+    if (ids := LISTINGS.get(key)) is None:
+        with switch_collection(Documents, Documents.as_user(user)) as user_documents:
+            ids = [str(son["_id"]) for son in user_documents._get_collection().find(query or {}, {"_id": 1})]
+        LISTINGS.put(key, ids)
+    return ids
 
 
-def get_search_documents(user: Users, search: str, sort: Sort) -> tuple[list[Documents], dict]:
-    """Return any documents matching the search term(s).
+def _listing_key(user: Users, query: dict | None, *args) -> tuple:
+    """Return the cache key of a listing from the user's current collection (at its current version) for the query.
+
+    The query is normalised (ie. serialised with sorted keys) and hashed as it can be large, eg. the ids
+    matched by our search index.
+    """
+    collection = Documents.as_user(user)
+    query_hash = hashlib.sha1(json_util.dumps(query or {}, sort_keys=True).encode(), usedforsecurity=False).hexdigest()
+    return (collection, get_version(collection), query_hash, *args)
+
+
+def search_query(user: Users, search: str) -> dict:
+    """Return the (single) database query representing the search term(s) using our configured search engine.
 
     Note: We use shlex.split to handle case of quoted strings in search input, e.g.: '"coconut milk" burmese'
     """
-    # We do an implicit "AND", thus, we want to capture the set of ids for each search term
-    # and then "AND" them together.
-    id_sets: list[set[str]] = []
-    for search_term in shlex.split(search):
-        ids = set()
-        for search_method in SEARCH_METHODS:
-            ids.update(search_method(user, search_term))
-        id_sets.append(ids)
-
-    ids_to_query = reduce(lambda a, b: a & b, id_sets)
-
-    # Return all the documents associated with the matching id's.
+    search_terms = shlex.split(search)
+    if current_app.config.get("SEARCH_ENGINE") == c.SEARCH_ENGINE_INDEX:
+        return _index_search_query(user, search_terms)
+    if current_app.config.get("SEARCH_ENGINE") == c.SEARCH_ENGINE_TEXT:
+        if query := _text_search_query(user, search_terms):
+            return query
+        # Text index doesn't help with partial words (eg. 'tamar'), in which case, we fall back to substrings.
+        log.debug(f"No text index matches for {search_terms}, falling back to substring search.")
+    return _substring_search_query(user, search_terms)
+
+
+def is_text_query(query: dict | None) -> bool:
+    """Is the query specified from our text search engine (ie. can we sort by relevance)?."""
+    return bool(query) and "$text" in query
+
+
+def _index_search_query(user: Users, search_terms: list[str]) -> dict:
+    """Return the query for the ids of documents matching the search term(s) from our in-process index."""
+    ids = INDICES.get(user).search(search_terms)
+    log.debug(f"{len(ids):,d} documents matched in search index.")
+    return {"_id": {"$in": ids}}
+
+
+def _text_search_query(user: Users, search_terms: list[str]) -> dict | None:
+    """Return the text index query for the search term(s) (or None if it doesn't match anything).
+
+    Single words are left unquoted, ie. stemmed ("cook" matches "cooking"), and only phrases are
+    quoted (eg. "coconut milk" must appear as such). As $text matches documents with *any* of
+    these whereas our search has always required all of them, multiple terms are matched one at a
+    time, each narrowing the ids matched by those before. Matches are ranked by our index weights.
+    """
+    if not (terms := [term for term in map(_text_term, search_terms) if term.strip('"')]):
+        return None
+    query = {"$text": {"$search": " ".join(terms)}}
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        documents = user_documents.objects(id__in=ids_to_query)
-    log.info(f"{len(documents):,d} documents found.")
+        documents = user_documents._get_collection()
+        if len(terms) == 1:
+            return query if documents.count_documents(query, limit=1) else None
+        ids = None
+        for term in terms:
+            term_query = {"$text": {"$search": term}} | ({"_id": {"$in": ids}} if ids is not None else {})
+            if not (ids := [son["_id"] for son in documents.find(term_query, {"_id": 1})]):
+                return None
+    return query | {"_id": {"$in": ids}}
+
+
+def _text_term(term: str) -> str:
+    """Return the term as searched by $text, ie. a phrase quoted and a word as is (bar any leading "-", a negation)."""
+    term = term.replace('"', "")
+    return f'"{term}"' if " " in term else term.lstrip("-")
+
+
+def _substring_search_query(user: Users, search_terms: list[str]) -> dict:
+    """Return the substring query for the search term(s).
+
+    Each of our "sub-search" methods contributes a query fragment for each search term; we "OR"
+    these together for each term and then do an implicit "AND" across the terms, for example,
+    'thai soup' becomes (title ~ thai OR source ~ thai OR tags = Thai) AND (title ~ soup OR...).
+    Documents whose file contains *all* the terms also match, looked up at once (see texts.py).
+    """
+    term_queries: list[QCombination] = []
+    for search_term in search_terms:
+        term_queries.append(reduce(or_, [search_method(user, search_term) for search_method in SEARCH_METHODS]))
 
-    return _sort(documents, sort)
+    if not term_queries:
+        return {}
+
+    query: QCombination = reduce(and_, term_queries) | Q(id__in=search_texts(user, search_terms))
+    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
+        return query.to_query(user_documents)
 
 
 ################################################################################
-# Sub-search methods
+# Sub-search methods (each returns the query "fragment" for a single search term)
 ################################################################################
-def _search_by_title(user: Users, search: str) -> list[ObjectId]:
+def _search_by_title(user: Users, search: str) -> Q:
     """Search all documents by "title"."""
-    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        partials: QuerySet = user_documents.objects(title__icontains=search).only("id")
-    if partials:
-        log.debug(f"{len(partials):,d} documents matched against 'title'")
-    return [doc.id for doc in partials]
+    return Q(title__icontains=search)
 
 
-def _search_by_source(user: Users, search: str) -> list[ObjectId]:
+def _search_by_source(user: Users, search: str) -> Q:
     """Search all documents by "source"."""
-    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        partials: QuerySet = user_documents.objects(source__icontains=search).only("id")
-    if partials:
-        log.debug(f"{len(partials):,d} documents matched against 'source'")
-    return [doc.id for doc in partials]
+    return Q(source__icontains=search)
 
 
-def _search_by_tag(user: Users, search: str) -> list[ObjectId]:
+def _search_by_tag(user: Users, search: str) -> Q:
     """Search all documents by tag(s)."""
     if any(chr.isspace() for chr in search):
         # Split and "title" the search terms to match those within the database.
@@ -82,33 +228,17 @@ def _search_by_tag(user: Users, search: str) -> list[ObjectId]:
 
         ########################################
         # For an "or" semantic (which is what Raindrop does! :-()
-        # documents = user_documents.objects(tags__in=search.split())
+        # return Q(tags__in=l_search)
         ########################################
         ...
 
         ########################################
         # However, for the *and* semantic:
         ########################################
-        from functools import reduce
-        from operator import and_
+        return reduce(and_, [Q(tags=tag) for tag in l_search])
 
-        from mongoengine.queryset.visitor import Q
-
-        queries: list[Q] = [Q(tags=tag) for tag in l_search]
-        query: QCombination = reduce(and_, queries)
-        with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-            partials: QuerySet = user_documents.objects(query).only("id")
-        if partials:
-            log.debug(f"{len(partials):,d} documents matched against multiple search terms")
-
-    else:
-        # No, use as is..
-        with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-            partials: QuerySet = user_documents.objects(tags=search.title()).only("id")
-        if partials:
-            log.debug(f"{len(partials):,d} documents matched against single search")
-
-    return [doc.id for doc in partials]
+    # No, use as is..
+    return Q(tags=search.title())
 
 
 def update_doc_from_form(request, document: Documents) -> tuple[Documents, bool]:
@@ -187,11 +317,11 @@ def update_doc_from_form(request, document: Documents) -> tuple[Documents, bool]
         filename = secure_filename(file.filename)  # Important! cleanse to remove bad characters!
         mime_type, _ = mimetypes.guess_type(filename)
         log.debug(
-            f"Saving a new file: {filename=} with {mime_type=}!"
-            if document.file_
-            else f"Replacing existing file {document.file_.filename=} with: {filename=}!"
+            f"Replacing existing file with: {filename=}!"
+            if document.blob or document.file_
+            else f"Saving a new file: {filename=} with {mime_type=}!"
         )
-        document.file_.replace(file, fileName=filename, contentType=mime_type)
+        put_document_file(document, file, filename, mime_type)
         changed = True
 
     return document, changed
@@ -199,141 +329,329 @@ def update_doc_from_form(request, document: Documents) -> tuple[Documents, bool]
 
 def delete_document(user: Users, id_: str) -> None:
     """Delete the document with specified id for the specified user."""
-    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        document = user_documents.objects(id=id_)[0]
-        if document.file_:
-            document.file_.delete()
-        document.delete()
-
-
-def update_document_attribute(document: Documents, field: str, request) -> [Documents, str | None]:
-    """Update the specified field attribute of the document request.form the specified request.form."""
-    error_msg = None
-    match field:
-        ##############################
-        # Simple attributes: Str
-        ##############################
-        case "title" | "notes" | "url_" | "source":
-            setattr(document, field, request.form.get(field))
-
-        ##############################
-        # Simple attributes: Int
-        ##############################
-        case "quality" | "complexity":
-            try:
-                new_value = int(request.form.get(field)) if request.form.get(field) else None
-                setattr(document, field, new_value)
-            except TypeError:
-                error_msg = f"Sorry, {request.form.get(field)} is not a valid integer value."
-
-        ##############################
-        # Special Handling: File upload
-        ##############################
-        case "file_":
-            file = request.files["file_"]
-            filename = secure_filename(file.filename)  # Important! cleanse to remove bad characters!
-            mime_type, _ = mimetypes.guess_type(filename)
-            document.file_.replace(file, fileName=filename, contentType=mime_type)
-
-        ##############################
-        # Special Attribute: List of string obo Tag
-        ##############################
-        case "tag":
-            document, error_msg = _update_document_tags(document, request)
-
-        ##############################
-        # Special Attribute: List of dates obo dates_cooked
-        ##############################
-        case "dates_cooked":
-            document, error_msg = _update_document_dates_cooked(document, request)
-
-        case _:
-            raise RuntimeError(f"Unrecognised {request.form.get('field')=}")
-
-    # If we haven't run into an issue thus far, try to save the document.
-    if not error_msg:
-        try:
-            document.save()
-        except Exception as exc:
-            error_msg = str(exc)
+    delete_documents(user, [id_])
 
-    return document, error_msg
 
+def delete_documents(user: Users, ids: list[str], background: bool = False) -> int:
+    """Delete the user's documents specified (all at once), returning how many were.
 
-def _update_document_tags(document: Documents, request) -> [Documents, str | None]:
-    """Update the "tags" attribute of the specified document for the specified request."""
-    if request.method == "POST":
-        # NEW tag to be added to the document
-        tag = request.form.get("tag")
-        if tag.title() not in document.tags:
-            document.tags.append(tag.title())
-        else:
-            return document, "Tag already appears for this document."
-    elif request.method == "DELETE":
-        # DELETE existing tag from the document
-        tag = request.values.get("tag")
-        document.update(pull__tags=tag)
-        document.reload()
+    The documents themselves go with a single delete_many, the files they refer to are then
+    released in bulk (see release_blobs), in a background job if specified (eg. for many).
+    """
+    collection = Documents.as_user(user)
+    object_ids = [ObjectId(id_) for id_ in ids if ObjectId.is_valid(id_)]
+    with switch_collection(Documents, collection) as user_documents:
+        documents = user_documents._get_collection()
+        sons = list(documents.find({"_id": {"$in": object_ids}}, {"blob": 1, "file_": 1, "tags": 1, "source": 1}))
+        deleted = documents.delete_many({"_id": {"$in": [son["_id"] for son in sons]}}).deleted_count
+    if not sons:
+        return 0
+
+    terms = {"tags": set(), "source": set()}
+    for son in sons:
+        for field_, values in document_terms(Documents._from_son(son)).items():
+            terms[field_] |= values
+    bump_version(collection)
+    refresh_vocabulary(collection, terms, None)
+    unindex_documents(user, [son["_id"] for son in sons])
+    delete_texts(user, [son["_id"] for son in sons])
+    release_blobs([blob_ref for son in sons if (blob_ref := _blob_ref(son))], background=background)
+    log.info(f"Deleted {deleted:,d} documents")
+    return deleted
+
+
+def _blob_ref(son: dict) -> BlobRef | None:
+    """Return the reference to the file of the (raw) document specified (without a GridFS lookup if legacy)."""
+    if son.get("blob"):
+        return BlobRef._from_son(son["blob"])
+    if son.get("file_"):
+        return BlobRef(store=STORE_GRIDFS, key=str(son["file_"]), length=0)  # (legacy files were never counted)
+    return None
+
+
+# fmt: off
+# For each field edited in place (see update_document_attribute), the fields rendered by its fragment
+# (ie. main/hx/edit_field_<field>.html) and the derived fields (see DERIVED_FIELDS) that depend on it.
+EDIT_FIELDS: dict[str, tuple[str, ...]] = {
+    "title"        : ("title",),
+    "notes"        : ("notes",),
+    "url_"         : ("url_",),
+    "source"       : ("source",),
+    "quality"      : ("quality",),
+    "complexity"   : ("complexity",),
+    "file_"        : ("blob", "file_"),
+    "tag"          : ("tags",),
+    "dates_cooked" : ("dates_cooked",),
+}
+EDIT_DERIVED: dict[str, tuple[str, ...]] = {
+    "quality"      : ("quality_by_complexity",),
+    "complexity"   : ("quality_by_complexity",),
+    "tag"          : ("tags_for_sort",),
+    "dates_cooked" : ("times_cooked",),
+}
+# fmt: on
+
+
+@dataclass
+class Edit:
+    """A single (atomic) edit of a document's field, ie. the update pipeline stages and how to apply the result."""
+
+    changes: dict = field(default_factory=dict)  # Fields $set (as expressions)
+    unset: list[str] = field(default_factory=list)  # Fields $unset
+    patch: dict | None = None  # If set, the document is returned *before* the update and these are our changes
+    query: dict = field(default_factory=dict)  # Additional condition(s) on the document to be updated
+    conflict_msg: str | None = None  # Error if the document doesn't meet these (eg. tag already there)
+    terms: dict | None = None  # Vocabulary values changed (unless we only know from the document returned)
+    error_msg: str | None = None  # Error with the request itself (ie. nothing to update)
+
+    def pipeline(self, derived: tuple[str, ...]) -> list[dict]:
+        """Return the update pipeline of this edit, including the derived fields specified."""
+        pipeline = [{"$set": self.changes | {"updated": datetime.utcnow()}}]
+        if self.unset:
+            pipeline.append({"$unset": self.unset})
+        if derived:
+            pipeline.append({"$set": {name: DERIVED_FIELDS[name] for name in derived}})
+        return pipeline
+
+
+def update_document_attribute(user: Users, doc_id: str, field_: str, request) -> [Documents, str | None]:
+    """Update the specified field attribute of the document from the specified request, atomically.
+
+    Each edit is a single find_one_and_update of just the field concerned (and the derived fields
+    depending on it) returning only what's rendered (and indexed), ie. one round-trip instead of a
+    load and save of the entire document, and no lost updates from edits elsewhere (eg. another tab).
+    """
+    if field_ not in EDITS:
+        raise RuntimeError(f"Unrecognised {field_=}")
+    if not ObjectId.is_valid(doc_id):
+        raise NotFound()
+
+    edit = EDITS[field_](field_, request)
+    if edit.error_msg:
+        return _get_edited_document(Documents.as_user(user), doc_id, field_), edit.error_msg
+
+    document, error_msg = apply_edit(user, Documents.as_user(user), doc_id, field_, edit)
+    if document is None:
+        return _get_edited_document(Documents.as_user(user), doc_id, field_), error_msg
     return document, None
 
 
-def _update_document_dates_cooked(document: Documents, request) -> [Documents, str | None]:
-    """Update the "dates_cooked" attribute of the specified document for the specified request."""
-    if request.method == "POST":
-        # NEW date to be added to the document
-        date_cooked = request.form.get("date_cooked")
-        date_cooked = datetime.strptime(date_cooked, "%Y-%m-%d")
-        if date_cooked not in document.dates_cooked:
-            document.dates_cooked.append(date_cooked)
-        else:
-            return document, "Sorry, your already have this date entered."
+def apply_edit(
+    user: Users,
+    collection: str,
+    doc_id: str,
+    field_: str,
+    edit: Edit,
+) -> tuple[Documents | None, str | None]:
+    """Apply the edit of the field of the user's document specified, returning the document (or None and why not).
+
+    Works on the raw collection (ie. rather than switch_collection, which swaps the collection of
+    Documents for the whole process) as we're also run from job threads (see assemble_upload).
+    A new file (see file_edit) is released if the document can't be updated, and the previous file
+    only once it has been, ie. the document never refers to a file that's been deleted.
+    """
+    try:
+        son = Documents._get_db()[collection].find_one_and_update(
+            {"_id": ObjectId(doc_id)} | edit.query,
+            edit.pipeline(EDIT_DERIVED.get(field_, ())),
+            projection=dict.fromkeys(EDIT_FIELDS[field_] + INDEX_FIELDS, 1),
+            return_document=ReturnDocument.AFTER if edit.patch is None else ReturnDocument.BEFORE,
+        )
+    except PyMongoError as exc:
+        son, error_msg = None, str(exc)
+    else:
+        error_msg = None if son else edit.conflict_msg
+
+    if son is None:
+        if field_ == "file_":
+            release_blob(BlobRef._from_son(edit.patch["blob"]))
+        return None, error_msg
+
+    if edit.patch is None:
+        document = Documents._from_son(son)
+        terms = (edit.terms, None)
+    else:
+        previous = Documents._from_son(son)
+        document = Documents._from_son(son | edit.patch)
+        terms = (document_terms(previous), document_terms(document))
+        if field_ == "file_" and (existing := previous.blob_ref):
+            release_blob(existing)
+
+    bump_version(collection)
+    index_document(user, document, collection)
+    refresh_vocabulary(collection, *terms)
+    if field_ == "file_":
+        request_thumbnail(user, document, collection)
+        request_text(user, document, collection)
 
-    elif request.method == "DELETE":
-        # DELETE existing date from the document
-        date_cooked = request.values.get("date_cooked")
-        document.update(pull__dates_cooked=date_cooked)
-        document.reload()
     return document, None
 
 
+def _edit_string(field_: str, request) -> Edit:
+    """Return the edit of a simple string attribute from the specified request."""
+    value = request.form.get(field_)
+    if error_msg := _validate_attribute(field_, value):
+        return Edit(error_msg=error_msg)
+    # (returning the document *before*, ie. so we know the previous source for our vocabulary)
+    return Edit(changes={field_: {"$literal": value}}, patch={field_: value})
+
+
+def _edit_int(field_: str, request) -> Edit:
+    """Return the edit of a simple integer attribute from the specified request."""
+    try:
+        value = int(request.form.get(field_)) if request.form.get(field_) else None
+    except (TypeError, ValueError):
+        return Edit(error_msg=f"Sorry, {request.form.get(field_)} is not a valid integer value.")
+    if error_msg := _validate_attribute(field_, value):
+        return Edit(error_msg=error_msg)
+    return Edit(changes={field_: value})
+
+
+def _edit_file(field_: str, request) -> Edit:
+    """Return the edit replacing the document's file with the one uploaded in the specified request."""
+    file = request.files["file_"]
+    filename = secure_filename(file.filename)  # Important! cleanse to remove bad characters!
+    mime_type, _ = mimetypes.guess_type(filename)
+    return file_edit(put_blob(file, filename, mime_type))
+
+
+def file_edit(blob_ref: BlobRef) -> Edit:
+    """Return the edit replacing the document's file with the (newly stored) blob specified."""
+    blob = blob_ref.to_mongo().to_dict()
+    # (returning the document *before*, ie. so we know which file to release)
+    return Edit(changes={"blob": {"$literal": blob}}, unset=["file_", "thumbnail"], patch={"blob": blob, "file_": None})
+
+
+def _edit_tag(field_: str, request) -> Edit:
+    """Return the edit of the "tags" attribute for the specified request."""
+    if request.method == "POST":
+        # NEW tag to be added to the document (unless it's already there)
+        if not (tag := (request.form.get("tag") or "").strip().title()):
+            raise BadRequest("Sorry, a tag is required.")
+        try:
+            Documents._fields["tags"].field.validate(tag)
+        except ValidationError as exc:
+            raise BadRequest(f"Sorry, invalid tag: '{tag}' ({exc})") from exc
+        return Edit(
+            changes={"tags": {"$sortArray": {"input": _append("$tags", tag), "sortBy": 1}}},
+            query={"tags": {"$ne": tag}},
+            conflict_msg="Tag already appears for this document.",
+            terms={"tags": {tag}},
+        )
+    # DELETE existing tag from the document
+    if not (tag := request.values.get("tag")):
+        raise BadRequest("Sorry, a tag is required.")
+    return Edit(changes={"tags": _remove("$tags", tag)}, terms={"tags": {tag}})
+
+
+def _edit_dates_cooked(field_: str, request) -> Edit:
+    """Return the edit of the "dates_cooked" attribute for the specified request."""
+    try:
+        date_cooked = datetime.strptime(request.values.get("date_cooked") or "", "%Y-%m-%d")
+    except ValueError as exc:
+        raise BadRequest("Sorry, a date (YYYY-MM-DD) is required.") from exc
+    if request.method == "POST":
+        # NEW date to be added to the document (unless it's already there)
+        return Edit(
+            changes={"dates_cooked": _append("$dates_cooked", date_cooked)},
+            query={"dates_cooked": {"$ne": date_cooked}},
+            conflict_msg="Sorry, your already have this date entered.",
+        )
+    # DELETE existing date from the document
+    return Edit(changes={"dates_cooked": _remove("$dates_cooked", date_cooked)})
+
+
+# fmt: off
+EDITS: dict[str, Callable[[str, Request], Edit]] = {
+    "title"        : _edit_string,
+    "notes"        : _edit_string,
+    "url_"         : _edit_string,
+    "source"       : _edit_string,
+    "quality"      : _edit_int,
+    "complexity"   : _edit_int,
+    "file_"        : _edit_file,
+    "tag"          : _edit_tag,
+    "dates_cooked" : _edit_dates_cooked,
+}
+# fmt: on
+
+
+def _validate_attribute(field: str, value) -> str | None:
+    """Return the error (if any) with the value for the document field specified, ie. as a save() would."""
+    if value is None:
+        return "Field is required" if Documents._fields[field].required else None
+    try:
+        Documents._fields[field].validate(value)
+    except ValidationError as exc:
+        return str(exc)
+    return None
+
+
+def _get_edited_document(collection: str, doc_id: str, field: str) -> Documents:
+    """Return the document specified as rendered after an edit of the field specified (eg. on an error)."""
+    with switch_collection(Documents, collection) as user_documents:
+        projection = dict.fromkeys(EDIT_FIELDS[field], 1)
+        if (son := user_documents._get_collection().find_one({"_id": ObjectId(doc_id)}, projection)) is None:
+            raise NotFound()
+    return Documents._from_son(son)
+
+
+def _append(array: str, value) -> dict:
+    """Return the update expression appending the value to the (possibly missing) array field specified."""
+    return {"$concatArrays": [{"$ifNull": [array, []]}, [{"$literal": value}]]}
+
+
+def _remove(array: str, value) -> dict:
+    """Return the update expression removing all occurrences of the value from the array field specified."""
+    return {"$filter": {"input": {"$ifNull": [array, []]}, "cond": {"$ne": ["$$this", {"$literal": value}]}}}
+
+
 ################################################################################
 # Utility methods
 ################################################################################
-def _sort(documents: list[Documents], sort: Sort) -> tuple[list[Documents], dict]:
-    """Return both a sorted list of documents by current cookies and sort-indicator status."""
-    # fmt: off
-    if sort.is_ascending():
-        # These are a bit complex *but* allow us to make sure that "None" entries of the
-        # respective `sort.by` field are always at the bottom, irrespective of `sort.order`.
-        sort_lambdas = {
-            "complexity"            : lambda doc: (doc.complexity            is None, doc.complexity            ),
-            "times_cooked"          : lambda doc: (doc.times_cooked          is None, doc.times_cooked           ),
-            "quality"               : lambda doc: (doc.quality               is None, doc.quality               ),
-            "quality_by_complexity" : lambda doc: (doc.quality_by_complexity is None, doc.quality_by_complexity ),
-            "source"                : lambda doc: (doc.source                is None, doc.source                ),
-            "tags"                  : lambda doc: (doc.tags_for_sort         is None, doc.tags_for_sort         ),
-            "title"                 : lambda doc:  doc.title,
-        }
-    else:
-        sort_lambdas = {
-            "complexity"            : lambda doc: (doc.complexity            is not None, doc.complexity            ),
-            "times_cooked"          : lambda doc: (doc.times_cooked          is not None, doc.times_cooked           ),
-            "quality"               : lambda doc: (doc.quality               is not None, doc.quality               ),
-            "quality_by_complexity" : lambda doc: (doc.quality_by_complexity is not None, doc.quality_by_complexity ),
-            "source"                : lambda doc: (doc.source                is not None, doc.source                ),
-            "tags"                  : lambda doc: (doc.tags_for_sort         is not None, doc.tags_for_sort         ),
-            "title"                 : lambda doc:  doc.title,
-        }
-    # fmt: on
-
-    if not (sort_lambda := sort_lambdas.get(sort.by)):
+# fmt: off
+# For each sort key, the field to sort on in the database or, for those that aren't actually
+# stored on the document, the expression to derive it from.
+SORT_FIELDS: dict[str, str | dict] = {
+    "complexity"            : "complexity",
+    "quality"               : "quality",
+    "quality_by_complexity" : "quality_by_complexity",
+    "relevance"             : {"$meta": "textScore"},  # Only available on text searches!
+    "source"                : "source",
+    "tags"                  : "tags_for_sort",
+    "times_cooked"          : "times_cooked",
+    "title"                 : "title",
+}
+# fmt: on
+
+SORT_FIELD_DERIVED = "_sort"  # Name of the temporary field holding a derived sort value.
+
+
+def _sort_field(sort: Sort, query: dict) -> tuple[str, dict | None]:
+    """Return the database field name to sort on and the expression to derive it (if not stored)."""
+    if sort.by not in SORT_FIELDS:
         log.error(f"Sorry, ran into a case where cookies.sort.by is unrecognized? '{sort.by}'")
-        sort_lambda = sort_lambdas.get("title")
+        return "title", None
+    if sort.by == "relevance" and not is_text_query(query):
+        log.debug("Sorry, can only sort by relevance on a text search, using title instead.")
+        return "title", None
+    if isinstance(sort_field := SORT_FIELDS[sort.by], dict):
+        return SORT_FIELD_DERIVED, sort_field
+    return sort_field, None
 
-    # Apply sort order/direction:
-    sorted_kwargs = {} if sort.is_ascending() else {"reverse": True}
 
-    return sorted(documents, key=sort_lambda, **sorted_kwargs)
+def _sort_pipeline(sort_expression: dict | None, query: dict, match: dict, order: dict, limit: int) -> list[dict]:
+    """Return the aggregation pipeline to return a single sorted "slice" of a collection (projected for the table).
+
+    The projection comes last, ie. so the matches and sort can use our (field, _id) indexes (and it
+    keeps the sort fields, eg. tags_for_sort, so we can position the next cursor).
+    """
+    pipeline = [{"$match": query}]
+    if sort_expression:
+        pipeline.append({"$addFields": {SORT_FIELD_DERIVED: sort_expression}})
+    projection = dict.fromkeys(DocumentRow.FIELDS, 1) | dict.fromkeys(order, 1)
+    pipeline.extend([{"$match": match}, {"$sort": order}, {"$limit": limit}, {"$project": projection}])
+    return pipeline
 
 
 def _find_search_methods(module: str, prefix: str) -> list[Callable]:
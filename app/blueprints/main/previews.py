@@ -0,0 +1,126 @@
+"""Previews of document files, ie. a thumbnail of the first page of each pdf.
+
+Thumbnails are rendered once per file (as a background job, so never as part of a request),
+stored on the document itself and served with long-lived cache headers by the key of the file
+they were rendered from, ie. a new file implies a new thumbnail (and url). Until one's been
+rendered, we serve a placeholder that clients won't cache.
+
+Rendering requires the (optional) pymupdf package, ie. poetry install --extras previews.
+"""
+
+import logging as log
+from functools import cache
+from types import ModuleType
+
+from bson.objectid import ObjectId
+from flask.wrappers import Request, Response
+
+import app.constants as c
+from app.blueprints.main.files import MAX_AGE_IMMUTABLE
+from app.jobs import enqueue, job
+from app.models.documents import Documents, Thumbnail
+from app.models.users import Users
+from app.storage import get_store
+
+PDF = "application/pdf"
+
+# Image served until a document's thumbnail has been rendered (or if it can't be).
+PLACEHOLDER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="160" height="207" viewBox="0 0 160 207">'
+    '<rect width="160" height="207" fill="#f5f5f5" stroke="#dbdbdb"/></svg>'
+)
+
+
+################################################################################
+# Serving
+################################################################################
+def send_thumbnail(user: Users, document: Documents, request: Request) -> Response:
+    """Return a response with the document's thumbnail, or a placeholder (requesting it) if not yet rendered."""
+    key = document.file_key
+    thumbnail = document.thumbnail
+    if not thumbnail or thumbnail.source != key:
+        request_thumbnail(user, document)
+        response = Response(PLACEHOLDER, mimetype="image/svg+xml")
+        response.cache_control.no_store = True
+        return response
+
+    if thumbnail.data:
+        response = Response(thumbnail.data, mimetype=thumbnail.content_type)
+    else:
+        response = Response(PLACEHOLDER, mimetype="image/svg+xml")  # (ie. we've tried, it can't be rendered)
+    response.set_etag(key)
+    response.cache_control.private = True
+    if request.args.get("v") == key:
+        response.cache_control.max_age = MAX_AGE_IMMUTABLE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+################################################################################
+# Rendering
+################################################################################
+def request_thumbnail(user: Users, document: Documents, collection: str | None = None) -> ObjectId | None:
+    """Queue the rendering of the thumbnail of the user's document (unless already queued), returning the job id.
+
+    As this is requested whenever the placeholder is served, a rendering of the same file that's
+    running (or has failed) isn't queued again, ie. only once the document's file changes.
+    """
+    if not get_pymupdf():
+        return None
+    collection = collection or Documents.as_user(user)
+    dedupe = f"thumbnail:{collection}:{document.id}:{document.file_key}"
+    return enqueue("thumbnail", dedupe=dedupe, user=user, retry_failed=False, collection=collection, doc_id=document.id)
+
+
+@job("thumbnail", limit=c.THUMBNAIL_JOB_LIMIT)
+def update_thumbnail(collection: str, doc_id: ObjectId) -> bool:
+    """Render and store the thumbnail of the document specified (unless already current), True if we did so.
+
+    Works on the raw collection (ie. rather than switch_collection) as we're typically run from a
+    job thread. The thumbnail is only stored if the document's file is still the one rendered.
+    """
+    db_collection = Documents._get_db()[collection]
+    son = db_collection.find_one({"_id": doc_id}, {"blob": 1, "file_": 1, "thumbnail.source": 1})
+    if not son:
+        return False
+    document = Documents._from_son(son)
+    if not (blob_ref := document.blob_ref) or (son.get("thumbnail") or {}).get("source") == blob_ref.key:
+        return False
+
+    thumbnail = Thumbnail(source=blob_ref.key)
+    if blob_ref.content_type in (None, PDF):  # (legacy files may not have a content type)
+        source = get_store(blob_ref.store).open(blob_ref)
+        try:
+            thumbnail.data = render_thumbnail(b"".join(source.read(0, source.length)))
+        except Exception as exc:
+            log.warning(f"Sorry, unable to render thumbnail of {blob_ref}: {exc}")
+        finally:
+            source.close()
+
+    file_filter = {"blob.key": blob_ref.key} if son.get("blob") else {"file_": son["file_"]}
+    result = db_collection.update_one({"_id": doc_id, **file_filter}, {"$set": {"thumbnail": thumbnail.to_mongo()}})
+    log.debug(f"Rendered thumbnail of {blob_ref} ({len(thumbnail.data or b''):,d} bytes)")
+    return result.modified_count == 1
+
+
+def render_thumbnail(pdf: bytes) -> bytes:
+    """Return a (jpeg) thumbnail image of the first page of the pdf specified."""
+    pymupdf = get_pymupdf()
+    with pymupdf.open(stream=pdf, filetype="pdf") as doc:
+        page = doc[0]
+        zoom = c.THUMBNAIL_WIDTH / page.rect.width
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes("jpeg", jpg_quality=c.THUMBNAIL_QUALITY)
+
+
+@cache
+def get_pymupdf() -> ModuleType | None:
+    """Return the pymupdf module if available (ie. it's an optional dependency, also used by texts.py)."""
+    try:
+        import pymupdf
+    except ImportError:
+        log.warning("Sorry, pymupdf isn't installed, no thumbnails or texts (poetry install --extras previews)")
+        return None
+    return pymupdf
@@ -1,25 +1,51 @@
 """Core Application Routes."""
 
+import hashlib
+import json
 import logging as log
-from functools import wraps
-from io import BytesIO
+from collections import Counter
+from collections.abc import Callable, Iterator
+from functools import cache, wraps
+from pathlib import Path
 
 import flask_login as fl
-from flask import make_response, redirect, render_template, request, send_file, url_for
+from bson.objectid import ObjectId
+from flask import (
+    current_app,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_template,
+    url_for,
+)
 from flask.wrappers import Response
 from flask_login import login_required
 from flask_wtf import FlaskForm
 from mongoengine.context_managers import switch_collection
 
 from app.blueprints.main import bp
+from app.blueprints.main.bulk_edits import bulk_edit, parse_ids, parse_operations
+from app.blueprints.main.files import send_stored_file
 from app.blueprints.main.operations import (
     delete_document,
-    get_all_documents,
-    get_search_documents,
+    delete_documents,
+    get_document_ids,
+    get_page_documents,
+    is_text_query,
+    search_query,
     update_document_attribute,
 )
-from app.models import Sort, categories_available
+from app.blueprints.main.previews import send_thumbnail
+from app.blueprints.main.search_index import index_document
+from app.blueprints.main.uploads import abandon_upload, create_upload, finalize_upload, get_upload, put_chunk
+from app.jobs import get_job
+from app.models import Cursor, categories_available
 from app.models.documents import Documents, sources_available, tags_available
+from app.models.versions import bump_version, get_version
+from app.storage import open_document_file
 
 
 def log_route_info(func):
@@ -34,6 +60,64 @@ def log_route_info(func):
     return wrapper
 
 
+################################################################################
+# Conditional request support, ie. for our main table (both the full page and
+# partials), we can tell if the client's copy is still current from the version
+# of the user's collection, without having to query (or render) any documents.
+################################################################################
+def conditional(etag: str, render: Callable[[], str | Iterator[str]]) -> Response:
+    """Return 304 Not Modified if the client has the response with the entity tag specified, otherwise render it.
+
+    Note that we always force the client to revalidate (ie. "no-cache") as our responses are only
+    current as of the collection's version.
+    """
+    if request.method in ("GET", "HEAD") and etag in request.if_none_match and "_flashes" not in session:
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def table_etag(template: str, cursor: Cursor, search: str | None = None) -> str:
+    """Return the (strong) entity tag of a rendering of the user's collection at its current version."""
+    collection = Documents.as_user(fl.current_user)
+    state = [
+        build_id(),
+        template,
+        collection,
+        get_version(collection),
+        current_app.config.get("SEARCH_ENGINE"),
+        cursor.encode(),
+        cursor.size,
+        search,
+    ]
+    return hashlib.sha1(json.dumps(state).encode(), usedforsecurity=False).hexdigest()
+
+
+def render_table(template: str, **context) -> str | Iterator[str]:
+    """Render the main table template specified, streaming it to the client as it's rendered (if so configured).
+
+    When streaming, the response goes out in fragments as each row is rendered (rather than being
+    assembled in memory first), ie. we never hold the HTML of the entire table in memory.
+    """
+    if current_app.config.get("STREAM_TEMPLATES"):
+        return stream_template(template, **context)
+    return render_template(template, **context)
+
+
+@cache
+def build_id() -> str:
+    """Return a digest of the application's source code and templates, ie. to invalidate all entity tags on deploy."""
+    digest = hashlib.sha1(usedforsecurity=False)
+    for path in sorted(Path(__file__).parents[2].rglob("*")):
+        if path.suffix in (".py", ".html"):
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
 ################################################################################
 @bp.get("/")
 @login_required
@@ -41,14 +125,24 @@ def log_route_info(func):
 def render_display(template="main/display.html") -> Response:
     """Render our main page on a full refresh."""
     # Get any sort info (probably not on initial display)
-    sort = Sort.factory(request)
-    log.debug(sort)
-
-    # Query the documents (and sort by last sort field/dir if we have one)
-    documents = get_all_documents(fl.current_user, sort)
+    cursor = Cursor.factory(request)
+    log.debug(cursor)
+
+    def render() -> str:
+        # Query the first slice of documents (and sort by last sort field/dir if we have one)
+        documents, num_docs, cursor_next = get_page_documents(fl.current_user, cursor)
+
+        # Render our template
+        render_args = {
+            "documents": documents,
+            "sort": cursor.sort,
+            "cursor_next": cursor_next,
+            "num_docs": num_docs,
+            "categories": categories_available(),
+        }
+        return render_table(template, **render_args)
 
-    # Render our template
-    return render_template(template, documents=documents, sort=sort, categories=categories_available())
+    return conditional(table_etag(template, cursor), render)
 
 
 ################################################################################
@@ -56,14 +150,20 @@ def render_display(template="main/display.html") -> Response:
 @login_required
 @log_route_info
 def hx_display(template="main/hx/display_table.html") -> Response:
-    """Re-render just our partial/main table for re-sort."""
-    sort = Sort.factory(request)  # Get any sort info (probably not on initial display)
+    """Re-render just our partial/main table for re-sort (or the next slice of rows on scrolling)."""
+    cursor = Cursor.factory(request)  # Get any sort/position info (probably not on initial display)
+    log.debug(cursor)
 
-    # Query all the documents for the respective category and sort based on our state requested.
-    documents = get_all_documents(fl.current_user, sort)
+    # Render our partial template of the main display table (or just the next set of rows):
+    if not cursor.is_first():
+        template = "main/hx/display_table_rows.html"
 
-    # Render our partial template of the main display table:
-    return render_template(template, documents=documents, sort=sort)
+    def render() -> str:
+        # Query the next slice of documents for the respective category and sort based on our state requested.
+        documents, num_docs, cursor_next = get_page_documents(fl.current_user, cursor)
+        return render_table(template, documents=documents, sort=cursor.sort, cursor_next=cursor_next, num_docs=num_docs)
+
+    return conditional(table_etag(template, cursor), render)
 
 
 ################################################################################
@@ -79,42 +179,49 @@ def hx_user_category_change() -> Response:
 
 
 ################################################################################
-@bp.post("/search")
+@bp.route("/search", methods=["GET", "POST"])
 @login_required
 @log_route_info
 def hx_search(template="main/hx/display_table.html") -> Response:
-    """Render just the results table based on a *SEARCH* request."""
-    sort = Sort.factory(request)
-    log.debug(sort)
-
-    # Search could come in directly from the search dialog box (ie.
-    # request.form) *or* from clicking a selected tag or source
-    # (ie. request.values...)
-    if request.values.get("search"):
-        search_term_s = request.values.get("search")
-        log.debug(f"direct search: {search_term_s}")
-    else:
-        search_term_s: str = request.form["search"]
-        log.debug(f"general search: {search_term_s}")
+    """Render just the results table based on a *SEARCH* request (or the next slice of rows on scrolling).
+
+    Search could come in directly from the search dialog box *or* from clicking a selected tag or
+    source (both as GET's such that the client can revalidate its copy, POST's are still supported).
+    """
+    cursor = Cursor.factory(request)
+    log.debug(cursor)
+
+    search_term_s: str = request.values.get("search", "")
+    log.debug(f"search: {search_term_s}")
 
-    if search_term_s == "*" or not search_term_s:
+    if not cursor.is_first():
+        template = "main/hx/display_table_rows.html"
+
+    def render() -> str:
         # Sometimes a "search" is not a "search" after all!
-        documents = get_all_documents(fl.current_user, sort)
-    else:
-        documents = get_search_documents(fl.current_user, search_term_s, sort)
-
-    doc_ids = [str(doc.id) for doc in documents]
-    print(doc_ids)
-
-    render_args = {
-        "documents": documents,
-        "sort": sort,
-        "search": search_term_s,
-        "form": FlaskForm(),
-        "doc_ids": "|".join(doc_ids),
-        "num_docs": len(documents),
-    }
-    return render_template(template, **render_args)
+        query = None if search_term_s == "*" or not search_term_s else search_query(fl.current_user, search_term_s)
+
+        documents, num_docs, cursor_next = get_page_documents(fl.current_user, cursor, query)
+
+        render_args = {
+            "documents": documents,
+            "sort": cursor.sort,
+            "cursor_next": cursor_next,
+            "search": search_term_s,
+            "relevance": is_text_query(query),  # Can we offer sorting by relevance?
+        }
+        if not cursor.is_first():
+            return render_table(template, **render_args)
+
+        doc_ids = get_document_ids(fl.current_user, query)
+        render_args |= {
+            "form": FlaskForm(),
+            "doc_ids": "|".join(doc_ids),
+            "num_docs": num_docs,
+        }
+        return render_table(template, **render_args)
+
+    return conditional(table_etag(template, cursor, search_term_s), render)
 
 
 ################################################################################
@@ -126,13 +233,9 @@ def route_view_document(doc_id: str, url: str = "main.render_display") -> Respon
     with switch_collection(Documents, Documents.as_user(fl.current_user)) as user_documents:
         document = user_documents.objects(id=doc_id)[0]
 
-    if document.file_:
-        file_contents = document.file_.read()
-        log.debug(f"{len(file_contents)=}")
-        contents: BytesIO = BytesIO(file_contents)
-        name: str = f"{doc_id}.pdf"
-        mimetype: str = document.file_.contentType
-        return send_file(contents, download_name=name, mimetype=mimetype)
+    if source := open_document_file(document):
+        log.debug(f"{source.length=} ({type(source).__name__})")
+        return send_stored_file(source, download_name=f"{doc_id}.pdf", request=request)
 
     elif document.url_:
         return redirect(document.url_)
@@ -144,6 +247,30 @@ def route_view_document(doc_id: str, url: str = "main.render_display") -> Respon
     return redirect(url_for(url))
 
 
+################################################################################
+@bp.get("/thumbnail/<doc_id>")
+@login_required
+def route_thumbnail(doc_id: str) -> Response:
+    """Return the thumbnail (ie. preview of the first page) of the document's file."""
+    if not ObjectId.is_valid(doc_id):
+        return Response(status=404)
+    with switch_collection(Documents, Documents.as_user(fl.current_user)) as user_documents:
+        document = user_documents.objects(id=doc_id).only("id", "blob", "file_", "thumbnail").first()
+    if not document or not document.file_key:
+        return Response(status=404)
+    return send_thumbnail(fl.current_user, document, request)
+
+
+################################################################################
+@bp.get("/jobs/<job_id>")
+@login_required
+def api_get_job(job_id: str) -> Response:
+    """Return the status of one of the user's background jobs (eg. rendering a thumbnail)."""
+    if not (job_ := get_job(job_id, fl.current_user)):
+        return Response(status=404)
+    return jsonify(job_.as_dict())
+
+
 ################################################################################
 @bp.post("/document/delete")
 @login_required
@@ -159,13 +286,33 @@ def render_delete_document(url: str = "main.render_display") -> Response:
 @login_required
 @log_route_info
 def render_delete_documents(url: str = "main.render_display") -> Response:
-    """Delete the specified Documents."""
+    """Delete the specified Documents (all at once, their files are released in the background)."""
     doc_ids = request.values["doc_ids"]
-    for doc_id in doc_ids.split("|"):
-        delete_document(fl.current_user, doc_id)
+    delete_documents(fl.current_user, doc_ids.split("|"), background=True)
     return redirect(url_for(url))
 
 
+################################################################################
+@bp.post("/documents/edit")
+@login_required
+@log_route_info
+def api_bulk_edit() -> Response:
+    """Apply the same change(s) to many documents at once, ie. those listed or matching a search (see bulk_edits.py).
+
+    Expects JSON, eg. {"search": "thai soup", "operations": [{"op": "add_tag", "value": "Quick"}]}
+    (or "ids": [...] instead of "search"), returns the outcome for each document.
+    """
+    if not isinstance(payload := request.get_json(silent=True), dict):
+        payload = {}
+    operations = parse_operations(payload.get("operations"))
+    if (ids := payload.get("ids")) is None:
+        search_term_s = payload.get("search", "")
+        query = None if search_term_s == "*" or not search_term_s else search_query(fl.current_user, search_term_s)
+        ids = [str(id_) for id_ in get_document_ids(fl.current_user, query)]
+    outcomes = bulk_edit(fl.current_user, parse_ids(ids), operations)
+    return jsonify({"documents": outcomes, "counts": Counter(outcomes.values())})
+
+
 ################################################################################
 ##
 @bp.route("/new", methods=["GET", "POST"])
@@ -191,6 +338,8 @@ def render_new_document() -> Response:
             user=fl.current_user, title=request.form.get("title"), category=fl.current_user.category
         )
         document.save()
+    bump_version(Documents.as_user(fl.current_user))
+    index_document(fl.current_user, document)
     return redirect(url_for("main.render_edit_document", doc_id=document.id))
 
 
@@ -218,11 +367,8 @@ def render_edit_document(doc_id: str | None, template: str = "main/edit.html") -
 @log_route_info
 def hx_edit_field(field: str, doc_id: str) -> Response:
     """Edit an particular field/attribute of an Document."""
-    with switch_collection(Documents, Documents.as_user(fl.current_user)) as user_documents:
-        document = user_documents.objects(id=doc_id)[0]
-
-        # Update the specified field in the document based on the inbound request, get doc and optional error msg
-        document, error_msg = update_document_attribute(document, field, request)
+    # Update the specified field in the document based on the inbound request, get doc and optional error msg
+    document, error_msg = update_document_attribute(fl.current_user, doc_id, field, request)
 
     return_args = {
         "document": document,
@@ -259,3 +405,60 @@ def hx_last_updated(doc_id: str, template: str = "main/hx/edit_last_updated.html
     with switch_collection(Documents, Documents.as_user(fl.current_user)) as user_documents:
         document = user_documents.objects(id=doc_id)[0]
     return render_template(template, document=document)
+
+
+################################################################################
+# Chunked (resumable) uploads of a document's file, ie. a JSON api rather than
+# HTMX partials (see uploads.py for the protocol).
+################################################################################
+@bp.post("/uploads")
+@login_required
+@log_route_info
+def api_create_upload() -> Response:
+    """Start a chunked upload of a file (of filename and length bytes) to the document of doc_id."""
+    upload = create_upload(
+        fl.current_user,
+        request.values.get("doc_id", ""),
+        request.values.get("filename"),
+        request.values.get("length", type=int),
+    )
+    return jsonify(upload.as_dict()), 201
+
+
+@bp.get("/uploads/<upload_id>")
+@login_required
+@log_route_info
+def api_get_upload(upload_id: str) -> Response:
+    """Return the state of the upload, ie. the chunks received and those still missing (eg. to resume it)."""
+    return jsonify(get_upload(fl.current_user, upload_id).as_dict())
+
+
+@bp.put("/uploads/<upload_id>/<int:number>")
+@login_required
+@log_route_info
+def api_put_chunk(upload_id: str, number: int) -> Response:
+    """Receive a single chunk of the upload (ie. the raw request body)."""
+    upload = get_upload(fl.current_user, upload_id)
+    sha256 = put_chunk(upload, number, request.stream, request.content_length)
+    return jsonify({"number": number, "sha256": sha256, "missing": upload.missing})
+
+
+@bp.post("/uploads/<upload_id>/finalize")
+@login_required
+@log_route_info
+def api_finalize_upload(upload_id: str) -> Response:
+    """Complete the upload, ie. queue the storing of the file received (optionally verifying its sha256).
+
+    The file is stored by a background job, ie. poll the upload until its status is done (or failed).
+    """
+    upload = finalize_upload(fl.current_user, get_upload(fl.current_user, upload_id), request.values.get("sha256"))
+    return jsonify(upload.as_dict()), 202
+
+
+@bp.delete("/uploads/<upload_id>")
+@login_required
+@log_route_info
+def api_delete_upload(upload_id: str) -> Response:
+    """Abandon the upload, discarding any chunks received (unless it's being stored)."""
+    abandon_upload(get_upload(fl.current_user, upload_id))
+    return Response(status=204)
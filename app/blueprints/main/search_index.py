@@ -0,0 +1,199 @@
+"""In-process inverted index of documents obo "instant" (ie. search-as-you-type) searching.
+
+We keep one index per document collection (ie. per user & category), built lazily on the first
+search against it and kept current incrementally from our write paths. Each index maps every
+normalised token (and prefix thereof) from a document's title, source, tags and notes to the set
+of compact integer "document numbers" that contain it, such that a search is just a handful of
+set intersections; MongoDB is only involved for the final fetch of the matching documents.
+
+Indices are held in a least-recently-used registry bounded by an (approximate) memory budget,
+ie. the indices of "cold" users are evicted first (and simply rebuilt on their next search).
+
+Each index also tracks the version of the collection it reflects (see app.models.versions): our
+write-path hooks below account for exactly one version bump each, such that an index that's fallen
+behind its collection (eg. on a write from another worker or a cli command) is simply rebuilt.
+"""
+
+from __future__ import annotations
+
+import logging as log
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from bson.objectid import ObjectId
+from flask import current_app
+from mongoengine.context_managers import switch_collection
+
+from app.models.documents import Documents
+from app.models.users import Users
+from app.models.versions import get_version
+
+INDEX_FIELDS = ("title", "source", "tags", "notes")  # Document fields we index.
+MIN_PREFIX = 2  # Shortest token prefix we index, ie. 'ta' -> tamarind but not 't'.
+MAX_BYTES = 64 * 1024 * 1024  # Default memory budget across all indices (see settings.toml: search_index_max_bytes)
+BYTES_PER_POSTING = 64  # Rough cost of a single document number in a posting set (for our memory budget).
+
+RE_TOKEN = re.compile(r"\w+")
+
+
+def tokenise(text: str | None) -> list[str]:
+    """Return the normalised tokens in the text specified, eg. 'Crème Brûlée!' -> ['crème', 'brûlée']."""
+    return RE_TOKEN.findall(text.casefold()) if text else []
+
+
+class SearchIndex:
+    """Inverted index over a single document collection."""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.ids: list[ObjectId | None] = []  # Document number -> document id (None if since deleted)
+        self.numbers: dict[ObjectId, int] = {}  # Document id -> document number
+        self.keys: dict[int, set[str]] = {}  # Document number -> keys posted (so we can remove them)
+        self.postings: dict[str, set[int]] = {}  # Key (ie. token or prefix) -> document numbers
+        self.num_postings = 0
+        self.version = 0  # Version of the collection this index reflects
+
+    @property
+    def size(self) -> int:
+        """Return the approximate memory consumed by this index (in bytes)."""
+        return self.num_postings * BYTES_PER_POSTING
+
+    def add(self, son: dict) -> None:
+        """Add (or replace) the raw document (ie. as from pymongo) specified to the index."""
+        id_ = son["_id"]
+        if (number := self.numbers.get(id_)) is None:
+            number = len(self.ids)
+            self.ids.append(id_)
+            self.numbers[id_] = number
+        else:
+            self._unpost(number)  # Replacing an existing document, re-use its number.
+
+        keys = set()
+        for field in INDEX_FIELDS:
+            values = son.get(field) or []
+            for value in [values] if isinstance(values, str) else values:
+                for token in tokenise(value):
+                    keys.update(token[:length] for length in range(MIN_PREFIX, len(token) + 1))
+                    keys.add(token)  # (in case it's shorter than our minimum prefix)
+
+        for key in keys:
+            self.postings.setdefault(key, set()).add(number)
+        self.keys[number] = keys
+        self.num_postings += len(keys)
+
+    def remove(self, id_: ObjectId) -> None:
+        """Remove the document with the id specified from the index (if it's there)."""
+        if (number := self.numbers.pop(id_, None)) is None:
+            return
+        self.ids[number] = None
+        self._unpost(number)
+
+    def _unpost(self, number: int) -> None:
+        """Remove all postings of the document number specified."""
+        keys = self.keys.pop(number, set())
+        for key in keys:
+            postings = self.postings[key]
+            postings.discard(number)
+            if not postings:
+                del self.postings[key]
+        self.num_postings -= len(keys)
+
+    def search(self, search_terms: list[str]) -> list[ObjectId]:
+        """Return the ids of documents matching *all* the search terms (each as a prefix of an indexed token)."""
+        matches: set[int] | None = None
+        for search_term in search_terms:
+            for token in tokenise(search_term):
+                postings = self.postings.get(token, set())
+                matches = set(postings) if matches is None else matches & postings
+                if not matches:
+                    return []
+        return [self.ids[number] for number in matches or ()]
+
+    @classmethod
+    def build(cls, collection: str, sons: Iterable[dict]) -> SearchIndex:
+        instance = cls(collection)
+        for son in sons:
+            instance.add(son)
+        return instance
+
+
+class SearchIndices:
+    """Registry of the indices currently in memory, evicting the least recently used over our memory budget."""
+
+    def __init__(self):
+        self.indices: OrderedDict[str, SearchIndex] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, user: Users) -> SearchIndex:
+        """Return the index for the user's current collection, building it if necessary (ie. if missing or stale)."""
+        collection = Documents.as_user(user)
+        version = get_version(collection)
+        with self.lock:
+            if collection in self.indices and self.indices[collection].version == version:
+                self.indices.move_to_end(collection)
+                return self.indices[collection]
+
+            with switch_collection(Documents, collection) as user_documents:
+                sons = user_documents._get_collection().find({}, dict.fromkeys(INDEX_FIELDS, 1))
+                index = SearchIndex.build(collection, sons)
+                index.version = version
+            log.info(f"Built search index for {collection}: {len(index.numbers):,d} documents, ~{index.size:,d} bytes")
+
+            self.indices[collection] = index
+            self._evict()
+            return index
+
+    def loaded(self, user: Users, collection: str | None = None) -> SearchIndex | None:
+        """Return the index for the user's collection (default: current) *only* if it's already in memory."""
+        with self.lock:
+            return self.indices.get(collection or Documents.as_user(user))
+
+    def _evict(self) -> None:
+        """Evict the least recently used indices until we're within budget (always keeping the most recent)."""
+        max_bytes = current_app.config.get("SEARCH_INDEX_MAX_BYTES", MAX_BYTES)
+        while len(self.indices) > 1 and sum(index.size for index in self.indices.values()) > max_bytes:
+            collection, _ = self.indices.popitem(last=False)
+            log.info(f"Evicted search index for {collection}")
+
+
+INDICES = SearchIndices()
+
+
+################################################################################
+# Write-path hooks, ie. keep any index already in memory current (each called
+# exactly once per bump of the collection's version).
+################################################################################
+def index_document(user: Users, document: Documents, collection: str | None = None) -> None:
+    """Add/update the document specified in the user's index (of the collection specified or current, if loaded)."""
+    with INDICES.lock:
+        if index := INDICES.loaded(user, collection):
+            index.add(document.to_mongo().to_dict())
+            index.version += 1
+            INDICES._evict()
+
+
+def unindex_documents(user: Users, ids: Iterable[str | ObjectId]) -> None:
+    """Remove the documents specified from the user's index (if loaded), eg. after a bulk delete."""
+    with INDICES.lock:
+        if index := INDICES.loaded(user):
+            for id_ in ids:
+                index.remove(ObjectId(id_))
+            index.version += 1
+
+
+def reindex_documents(user: Users, ids: Iterable[str | ObjectId], collection: str | None = None) -> None:
+    """Refresh the documents specified in the user's index (if loaded) from the database, eg. after a bulk update.
+
+    Works on the raw collection (ie. rather than switch_collection) as we may be run from a job thread.
+    """
+    collection = collection or Documents.as_user(user)
+    with INDICES.lock:
+        if not (index := INDICES.loaded(user, collection)):
+            return
+        ids = [ObjectId(id_) for id_ in ids]
+        for son in Documents._get_db()[collection].find({"_id": {"$in": ids}}, dict.fromkeys(INDEX_FIELDS, 1)):
+            index.add(son)
+        index.version += 1
+        INDICES._evict()
@@ -0,0 +1,124 @@
+"""Full-text search of the contents of document files, ie. the ingredients and instructions inside each pdf.
+
+The text of each file is extracted once (as a background job, on upload/import, or in bulk by
+app/cli/extract_texts.py) and kept in a side collection alongside each document collection (ie.
+"texts-<userId>-<category>" for "documents-<userId>-<category>"), text-indexed such that a
+search is an index lookup rather than a scan of the text of every pdf. As with thumbnails, each
+text records the key of the file it was extracted from, ie. it's only re-extracted when that changes.
+
+Extraction requires the (optional) pymupdf package, ie. poetry install --extras previews.
+"""
+
+import datetime as dt
+import logging as log
+
+from bson.objectid import ObjectId
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+import app.constants as c
+from app.blueprints.main.previews import PDF, get_pymupdf
+from app.jobs import enqueue, job
+from app.models.documents import Documents
+from app.models.users import Users
+from app.models.versions import bump_version
+from app.storage import get_store
+
+_INDEXED: set[str] = set()  # Text collections we've ensured are indexed (in this process)
+INDEX_NOT_FOUND = 27  # MongoDB error code of a $text query of a collection without a text index
+
+
+################################################################################
+# Searching
+################################################################################
+def search_texts(user: Users, search_terms: list[str]) -> list[ObjectId]:
+    """Return the ids of the user's documents whose file contains all the search terms (words or phrases).
+
+    The terms are looked up with a single $text query, each quoted such that all of them must match
+    (rather than any). A collection without any text yet (ie. not yet indexed) matches nothing.
+    """
+    query = {"$text": {"$search": " ".join(f'"{term.replace(chr(34), "")}"' for term in search_terms)}}
+    try:
+        return [son["_id"] for son in texts_collection(Documents.as_user(user)).find(query, {"_id": 1})]
+    except OperationFailure as exc:
+        if exc.code != INDEX_NOT_FOUND:
+            raise
+        return []
+
+
+def delete_texts(user: Users, doc_ids: list[ObjectId | str]) -> None:
+    """Delete the texts of the user's documents specified (eg. on deleting the documents)."""
+    texts_collection(Documents.as_user(user)).delete_many({"_id": {"$in": [ObjectId(id_) for id_ in doc_ids]}})
+
+
+def texts_collection(collection: str, ensure_index: bool = False) -> Collection:
+    """Return the text collection for the document collection specified (first creating its index if writing).
+
+    (ie. only storing a text creates the collection and its index, rather than eg. every search)
+    """
+    name = collection.replace("documents-", "texts-", 1)
+    texts = Documents._get_db()[name]
+    if ensure_index and name not in _INDEXED:
+        texts.create_index([("text", "text")], default_language="english")
+        _INDEXED.add(name)
+    return texts
+
+
+################################################################################
+# Extraction
+################################################################################
+def request_text(user: Users, document: Documents, collection: str | None = None) -> ObjectId | None:
+    """Queue the extraction of the text of the user's document (unless already queued), returning the job id."""
+    if not get_pymupdf():
+        return None
+    collection = collection or Documents.as_user(user)
+    dedupe = f"extract_text:{collection}:{document.id}:{document.file_key}"
+    return enqueue("extract_text", dedupe=dedupe, user=user, collection=collection, doc_id=document.id)
+
+
+@job("extract_text", limit=c.TEXT_JOB_LIMIT)
+def update_text(collection: str, doc_id: ObjectId) -> bool:
+    """Extract and store the text of the document specified (unless already current), True if we did so.
+
+    Works on the raw collections (ie. rather than switch_collection) as we're typically run from a
+    job thread or a process of the backfill's pool.
+    """
+    son = Documents._get_db()[collection].find_one({"_id": doc_id}, {"blob": 1, "file_": 1})
+    texts = texts_collection(collection, ensure_index=True)
+    if not son or not (blob_ref := Documents._from_son(son).blob_ref):
+        texts.delete_one({"_id": doc_id})
+        return False
+    if (existing := texts.find_one({"_id": doc_id}, {"source": 1})) and existing["source"] == blob_ref.key:
+        return False
+
+    text = ""
+    if blob_ref.content_type in (None, PDF):  # (legacy files may not have a content type)
+        source = get_store(blob_ref.store).open(blob_ref)
+        try:
+            text = extract_text(b"".join(source.read(0, source.length)))
+        except Exception as exc:
+            log.warning(f"Sorry, unable to extract text of {blob_ref}: {exc}")
+        finally:
+            source.close()
+
+    texts.replace_one(
+        {"_id": doc_id},
+        {"source": blob_ref.key, "text": text, "extracted": dt.datetime.utcnow()},
+        upsert=True,
+    )
+    bump_version(collection)  # (ie. searches cached against the collection may now match differently)
+    log.debug(f"Extracted text of {blob_ref} ({len(text):,d} characters)")
+    return True
+
+
+def extract_text(pdf: bytes) -> str:
+    """Return the (normalised) text of the pdf specified, ie. lower-case, single-spaced and at most TEXT_MAX_CHARS."""
+    chars, parts = 0, []
+    with get_pymupdf().open(stream=pdf, filetype="pdf") as doc:
+        for page in doc:
+            part = " ".join(page.get_text().split()).lower()
+            parts.append(part)
+            chars += len(part) + 1
+            if chars >= c.TEXT_MAX_CHARS:
+                break
+    return " ".join(parts)[: c.TEXT_MAX_CHARS]
@@ -0,0 +1,235 @@
+"""Chunked (and resumable) uploads of document files.
+
+Rather than a single multipart form post of the entire file (which fails all at once on a flaky
+connection), a client can:
+
+1. Create an upload session for a document, giving the file's name and size.
+2. PUT each numbered chunk (in any order, re-sending any that failed), each staged in GridFS as
+   it's read from the request, ie. memory stays flat irrespective of the size of the file.
+3. Finalize the session, at which point a background job streams (and hashes) the staged chunks
+   into blob storage as the document's file, ie. rather than within the request.
+4. Poll the session until it's done (or failed, eg. the file didn't match its sha256).
+
+At any point, the session tells the client which chunks we've still to receive (ie. to resume
+after a disconnect). Abandoned sessions (and their chunks) are purged after UPLOAD_MAX_AGE.
+"""
+
+import datetime as dt
+import logging as log
+import mimetypes
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import gridfs
+from bson.objectid import ObjectId
+from flask import current_app
+from mongoengine.connection import get_db
+from werkzeug.exceptions import BadRequest, Conflict, LengthRequired, NotFound, RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+import app.constants as c
+from app.blueprints.main.operations import apply_edit, file_edit
+from app.jobs import enqueue, job
+from app.models.documents import Documents
+from app.models.uploads import ASSEMBLING, DONE, FAILED, RECEIVING, Uploads
+from app.models.users import Users
+from app.storage import put_blob, release_blob
+from app.storage.base import BLOCK_SIZE, BlocksReader, HashingReader
+
+STAGING_COLLECTION = "uploads"  # GridFS bucket holding the chunks received (until the upload is finalized)
+
+
+################################################################################
+# Upload sessions
+################################################################################
+def create_upload(user: Users, doc_id: str, filename: str | None, length: int | None) -> Uploads:
+    """Create (and return) a new upload session for a file of the name and size specified to the document.
+
+    The session records the document's collection, ie. the file goes to that document even if the
+    user switches category before it's finalized.
+    """
+    collection = Documents.as_user(user)
+    if not ObjectId.is_valid(doc_id) or not Documents._get_db()[collection].find_one({"_id": ObjectId(doc_id)}, {}):
+        raise NotFound(f"Sorry, no document with id: '{doc_id}'")
+    if not (filename := secure_filename(filename or "")):  # Important! cleanse to remove bad characters!
+        raise BadRequest("Sorry, a filename is required.")
+    if not length or length < 1:
+        raise BadRequest("Sorry, the length of the file (in bytes) is required.")
+    if length > (max_bytes := current_app.config.get("UPLOAD_MAX_BYTES", c.UPLOAD_MAX_BYTES)):
+        raise RequestEntityTooLarge(f"Sorry, files can be at most {max_bytes:,d} bytes.")
+
+    purge_uploads()
+
+    mime_type, _ = mimetypes.guess_type(filename)
+    upload = Uploads(
+        user=user,
+        collection=collection,
+        doc_id=doc_id,
+        filename=filename,
+        content_type=mime_type,
+        length=length,
+        chunk_size=current_app.config.get("UPLOAD_CHUNK_SIZE", c.UPLOAD_CHUNK_SIZE),
+    )
+    upload.save()
+    log.debug(f"Started upload {upload.id} of {filename=} ({length:,d} bytes in {upload.count_chunks} chunks)")
+    return upload
+
+
+def get_upload(user: Users, upload_id: str) -> Uploads:
+    """Return the user's upload session specified."""
+    if not ObjectId.is_valid(upload_id) or not (upload := Uploads.objects(id=upload_id, user=user).first()):
+        raise NotFound(f"Sorry, no upload with id: '{upload_id}'")
+    return upload
+
+
+def put_chunk(upload: Uploads, number: int, stream: BinaryIO, content_length: int | None) -> str:
+    """Stage the chunk specified, read from the stream (ie. the request body), returning its sha256.
+
+    Chunks must be exactly the expected size (ie. chunk_size, other than the last) and re-sending a
+    chunk simply replaces it: each is staged under a fresh id and only then swapped into the session
+    (atomically, provided it's not been finalized), ie. a chunk being assembled is never replaced.
+    """
+    if upload.status in (ASSEMBLING, DONE):
+        raise Conflict(f"Sorry, upload {upload.id} has already been finalized.")
+    if not 0 <= number < upload.count_chunks:
+        raise NotFound(f"Sorry, chunk {number} is out of range (0 to {upload.count_chunks - 1}).")
+    if content_length is None:
+        raise LengthRequired("Sorry, chunks require a Content-Length.")
+    if content_length != (expected := upload.chunk_length(number)):
+        if content_length > expected:
+            raise RequestEntityTooLarge(f"Sorry, chunk {number} should be {expected:,d} bytes.")
+        raise BadRequest(f"Sorry, chunk {number} should be {expected:,d} bytes.")
+
+    staging = _staging()
+    chunk_id = _chunk_id(upload, number)
+    reader = HashingReader(stream)
+    grid_in = staging.new_file(_id=chunk_id)
+    try:
+        while block := reader.read(min(BLOCK_SIZE, expected - reader.length)):
+            grid_in.write(block)
+        if reader.length != expected:
+            raise BadRequest(f"Sorry, chunk {number} was incomplete ({reader.length:,d} of {expected:,d} bytes).")
+        grid_in.close()
+    except gridfs.errors.FileExists as exc:
+        grid_in.abort()
+        raise Conflict(f"Sorry, chunk {number} is already being received.") from exc
+    except BaseException:
+        grid_in.abort()
+        raise
+
+    chunk = {"id": chunk_id, "sha256": reader.sha256}
+    previous = Uploads._get_collection().find_one_and_update(
+        {"_id": upload.id, "status": {"$nin": [ASSEMBLING, DONE]}},
+        {"$set": {f"received.{number}": chunk}},
+        projection={f"received.{number}": 1},
+    )
+    if previous is None:
+        staging.delete(chunk_id)
+        raise Conflict(f"Sorry, upload {upload.id} has already been finalized.")
+    if replaced := (previous.get("received") or {}).get(str(number)):
+        staging.delete(replaced["id"])  # (ie. re-sent)
+    upload.received[str(number)] = chunk
+    return reader.sha256
+
+
+def finalize_upload(user: Users, upload: Uploads, sha256: str | None = None) -> Uploads:
+    """Queue the storing of the file from all its chunks as the document's file, returning the session.
+
+    As copying the entire file takes a while, it's done by a job (see assemble_upload), with the
+    client polling the session for its outcome. If the client gave us the sha256 of the entire
+    file, the file is only stored if it matches. Finalizing a session that's already being (or
+    has been) assembled simply returns it, whereas a failed one can be finalized again.
+    """
+    if missing := upload.missing:
+        raise Conflict(f"Sorry, still missing {len(missing):,d} chunk(s), eg. {missing[:10]}.")
+
+    claimed = Uploads.objects(id=upload.id, status__in=[RECEIVING, FAILED]).modify(
+        new=True,
+        set__status=ASSEMBLING,
+        set__sha256=sha256.lower() if sha256 else None,
+        unset__error=True,
+    )
+    if not claimed:
+        upload.reload()
+        return upload
+    claimed.job = enqueue("assemble_upload", dedupe=f"assemble_upload:{upload.id}", user=user, upload_id=upload.id)
+    Uploads.objects(id=upload.id).update_one(set__job=claimed.job)
+    return claimed
+
+
+@job("assemble_upload")
+def assemble_upload(upload_id: ObjectId) -> None:
+    """Store the file from all the upload's chunks as its document's file, recording the outcome on the session."""
+    if not (upload := Uploads.objects(id=upload_id, status=ASSEMBLING).first()):
+        return  # (ie. already done, or deleted)
+    try:
+        blob = put_blob(BlocksReader(_iter_staged(upload)), upload.filename, upload.content_type)
+        if upload.sha256 and blob.sha256 != upload.sha256:
+            release_blob(blob)
+            _upload_failed(upload, f"Sorry, the file received doesn't match sha256={upload.sha256}, please re-send it.")
+            return
+        # (ie. atomically, releasing our blob if the document's gone and the previous one only once replaced)
+        document, error_msg = apply_edit(upload.user, upload.collection, str(upload.doc_id), "file_", file_edit(blob))
+    except Exception as exc:
+        log.exception(f"Sorry, unable to assemble upload {upload.id}")
+        _upload_failed(upload, f"Sorry, unable to store the file: {exc}")
+        return
+    if document is None:
+        _upload_failed(upload, error_msg or f"Sorry, no document with id: '{upload.doc_id}'")
+        return
+
+    Uploads.objects(id=upload.id).update_one(set__status=DONE, set__blob=blob)
+    _delete_staged(upload)
+    log.debug(f"Finished upload {upload.id} as {blob} ({blob.length:,d} bytes)")
+
+
+def abandon_upload(upload: Uploads) -> None:
+    """Delete the upload session specified at the client's request (unless its file is being stored)."""
+    if upload.status == ASSEMBLING:
+        raise Conflict("Sorry, the upload is being stored, please wait for it to finish.")
+    delete_upload(upload)
+
+
+def delete_upload(upload: Uploads) -> None:
+    """Delete the upload session specified, along with any chunks staged."""
+    _delete_staged(upload)
+    upload.delete()
+
+
+def purge_uploads() -> None:
+    """Delete all upload sessions (of any user) abandoned for longer than UPLOAD_MAX_AGE."""
+    for upload in Uploads.objects(created__lt=dt.datetime.utcnow() - c.UPLOAD_MAX_AGE):
+        log.info(f"Purging abandoned upload {upload.id} ({len(upload.received)} chunk(s) staged)")
+        delete_upload(upload)
+
+
+################################################################################
+# Utility methods
+################################################################################
+def _staging() -> gridfs.GridFS:
+    return gridfs.GridFS(get_db(), collection=STAGING_COLLECTION)
+
+
+def _chunk_id(upload: Uploads, number: int) -> str:
+    return f"{upload.id}-{number}-{ObjectId()}"  # (ie. unique to each time the chunk is sent)
+
+
+def _delete_staged(upload: Uploads) -> None:
+    staging = _staging()
+    for chunk in upload.received.values():
+        staging.delete(chunk["id"])
+
+
+def _upload_failed(upload: Uploads, error: str) -> None:
+    log.warning(f"Upload {upload.id} failed: {error}")
+    Uploads.objects(id=upload.id).update_one(set__status=FAILED, set__error=error)
+
+
+def _iter_staged(upload: Uploads) -> Iterator[bytes]:
+    """Yield the contents of the staged chunks in order, a GridFS chunk at a time."""
+    staging = _staging()
+    for number in range(upload.count_chunks):
+        grid_out = staging.get(upload.received[str(number)]["id"])
+        while block := grid_out.readchunk():
+            yield block
+        grid_out.close()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Backfill (ie. recalculate) the derived sort fields of all existing documents, in batches."""
+
+import argparse
+import os
+import time
+
+from mongoengine.context_managers import switch_collection
+
+import app.constants as c
+from app import create_app
+from app.cli import setup_logging
+from app.models.documents import Documents
+from app.models.users import Users
+from app.models.versions import bump_version
+
+
+def main(args: argparse.Namespace):
+    """Backfill the derived fields across all document collections of all users."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    app = create_app(logging=None)
+    with app.app_context():
+        db = Documents._get_db()
+        for user in Users.objects():
+            for collection in sorted(db.list_collection_names(filter={"name": {"$regex": f"^documents-{user.id}-"}})):
+                backfill(collection, args.batch_size)
+
+
+def backfill(collection: str, batch_size: int) -> None:
+    """Backfill the derived fields of the documents in the collection specified in batches of ids."""
+    count_updated, count_documents = 0, 0
+    print(f"Backfilling: {collection} ", end="")
+    with switch_collection(Documents, collection) as user_documents:
+        ids = [son["_id"] for son in user_documents._get_collection().find({}, {"_id": 1}).sort("_id")]
+        for offset in range(0, len(ids), batch_size):
+            batch = ids[offset : offset + batch_size]
+            count_updated += user_documents.update_derived_fields({"_id": {"$in": batch}})
+            count_documents += len(batch)
+            print("•", end="", flush=True)
+            time.sleep(0.1)  # Don't hog the (remote) database.
+    if count_updated:
+        bump_version(collection)
+    print()
+    print(f"Updated {count_updated:,d} of {count_documents:,d} documents in {collection}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Backfill Derived Fields")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        help="Number of documents to update in each batch (default is 500).",
+        type=int,
+        default=500,
+    )
+
+    ARGS = parser.parse_args()
+
+    # Validate..
+    assert ARGS.database in ("production", "development")
+
+    main(ARGS)
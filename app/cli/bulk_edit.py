@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Apply the same change(s) to many of a user's documents at once, ie. those listed or matching a search."""
+
+import argparse
+import os
+from collections import Counter
+
+from werkzeug.exceptions import BadRequest
+
+import app.constants as c
+from app import create_app
+from app.blueprints.main.bulk_edits import UPDATED, bulk_edit, parse_operation
+from app.blueprints.main.operations import get_document_ids, search_query
+from app.cli import setup_logging
+from app.models import categories_available
+from app.models.documents import CategoryField
+from app.models.users import Users
+
+
+def main(args: argparse.Namespace):
+    """Apply the operations specified to the documents specified (or matching the search), reporting the outcomes."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    app = create_app(logging=None)
+    with app.app_context():
+        user = Users.objects.get(email=args.email)
+        if args.category:
+            user.category = str(CategoryField().to_python(args.category))  # (ie. just for this run, not saved)
+
+        try:
+            operations = [
+                *[parse_operation("add_tag", tag) for tag in args.add_tag],
+                *[parse_operation("remove_tag", tag) for tag in args.remove_tag],
+                *([parse_operation("set_source", args.source)] if args.source is not None else []),
+                *([parse_operation("set_quality", args.quality)] if args.quality is not None else []),
+                *([parse_operation("set_complexity", args.complexity)] if args.complexity is not None else []),
+                *[parse_operation("add_date_cooked", date) for date in args.cooked],
+            ]
+        except BadRequest as exc:
+            raise SystemExit(exc.description) from exc
+        if not operations:
+            raise SystemExit("Sorry, you need to specify at least one change to make (see --help).")
+
+        if args.ids:
+            ids = args.ids
+        else:
+            query = None if args.search == "*" else search_query(user, args.search)
+            ids = get_document_ids(user, query)
+
+        outcomes = bulk_edit(user, ids, operations)
+        for id_, outcome in outcomes.items():
+            if args.verbose or outcome != UPDATED:
+                print(f"{id_} {outcome}")
+        print(", ".join(f"{count:,d} {outcome}" for outcome, count in Counter(outcomes.values()).items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Bulk edit documents")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    parser.add_argument(
+        "-e",
+        "--email",
+        help="Email of the user whose documents are to be edited.",
+        required=True,
+    )
+
+    parser.add_argument(
+        "-c",
+        "--category",
+        help=f"Category of documents to edit, eg. {', '.join(categories_available())} (default: current).",
+    )
+
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--ids", help="Ids of the documents to edit.", nargs="+")
+    targets.add_argument("--search", help="Edit all documents matching this search ('*' for all).")
+
+    parser.add_argument("--add-tag", help="Tag to add (repeatable).", action="append", default=[])
+    parser.add_argument("--remove-tag", help="Tag to remove (repeatable).", action="append", default=[])
+    parser.add_argument("--source", help="Source to set ('' to clear it).")
+    parser.add_argument("--quality", help="Quality to set ('' to clear it).")
+    parser.add_argument("--complexity", help="Complexity to set ('' to clear it).")
+    parser.add_argument("--cooked", help="Date cooked to add, eg. 2024-02-21.", action="append", default=[])
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Show the outcome for every document (rather than just those not updated).",
+        action="store_true",
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Extract the text of all documents without a current one (eg. those stored before we did so), on all cores.
+
+Resumable, ie. documents whose text is already current are skipped, so simply re-run if interrupted.
+"""
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bson.objectid import ObjectId
+
+import app.constants as c
+from app import create_app
+from app.blueprints.main.texts import texts_collection, update_text
+from app.cli import setup_logging
+from app.models.documents import Documents
+from app.models.users import Users
+
+
+def main(args: argparse.Namespace):
+    """Extract the texts across all document collections of all users."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    app = create_app(logging=None)
+    with app.app_context():
+        db = Documents._get_db()
+        collections = [
+            collection
+            for user in Users.objects()
+            for collection in sorted(db.list_collection_names(filter={"name": {"$regex": f"^documents-{user.id}-"}}))
+        ]
+
+    # Each process of the pool has its own app (and thus database connection), ie. nothing's inherited over a fork.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.processes, mp_context=context, initializer=_init, initargs=(args.database,)) as pool:
+        for collection in collections:
+            with app.app_context():
+                ids = _stale(collection)
+            print(f"Extracting: {collection} ", end="")
+            count_extracted = 0
+            for extracted in pool.map(_update_text, [collection] * len(ids), ids, chunksize=8):
+                if extracted:
+                    count_extracted += 1
+                    print("•", end="", flush=True)
+            print()
+            print(f"Extracted {count_extracted:,d} of {len(ids):,d} texts in {collection}")
+
+
+def _stale(collection: str) -> list[ObjectId]:
+    """Return the ids of the documents in the collection whose text is missing or from another file."""
+    query = {"$or": [{"blob": {"$ne": None}}, {"file_": {"$ne": None}}]}
+    sources = {son["_id"]: son["source"] for son in texts_collection(collection).find({}, {"source": 1})}
+    stale = []
+    for son in Documents._get_db()[collection].find(query, {"blob.key": 1, "file_": 1}).sort("_id"):
+        key = (son.get("blob") or {}).get("key") or str(son.get("file_"))
+        if sources.get(son["_id"]) != key:
+            stale.append(son["_id"])
+    return stale
+
+
+_APP = None  # (ie. of each process of the pool)
+
+
+def _init(database: str) -> None:
+    global _APP  # noqa: PLW0603
+    os.environ["FLASK_ENV"] = database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    _APP = create_app(logging=None)
+
+
+def _update_text(collection: str, doc_id: ObjectId) -> bool:
+    with _APP.app_context():
+        return update_text(collection, doc_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Extract Texts")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        help="Number of processes to extract with (default is one per core).",
+        type=int,
+        default=os.cpu_count(),
+    )
+
+    ARGS = parser.parse_args()
+
+    # Validate..
+    assert ARGS.database in ("production", "development")
+
+    main(ARGS)
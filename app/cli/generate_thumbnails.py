@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Render the thumbnails of all documents without a current one (eg. those imported or stored before we did so).
+
+Resumable, ie. documents whose thumbnail is already current are skipped, so simply re-run if interrupted.
+"""
+
+import argparse
+import os
+
+import app.constants as c
+from app import create_app
+from app.blueprints.main.previews import update_thumbnail
+from app.cli import setup_logging
+from app.models.documents import Documents
+from app.models.users import Users
+
+
+def main(args: argparse.Namespace):
+    """Render the thumbnails across all document collections of all users."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    app = create_app(logging=None)
+    with app.app_context():
+        db = Documents._get_db()
+        for user in Users.objects():
+            for collection in sorted(db.list_collection_names(filter={"name": {"$regex": f"^documents-{user.id}-"}})):
+                generate(collection)
+
+
+def generate(collection: str) -> None:
+    """Render the thumbnails of the documents in the collection specified (unless already current)."""
+    query = {"$or": [{"blob": {"$ne": None}}, {"file_": {"$ne": None}}]}
+    ids = [son["_id"] for son in Documents._get_db()[collection].find(query, {"_id": 1}).sort("_id")]
+    count_rendered = 0
+    print(f"Rendering: {collection} ", end="")
+    for doc_id in ids:
+        if update_thumbnail(collection, doc_id):
+            count_rendered += 1
+            print("•", end="", flush=True)
+    print()
+    print(f"Rendered {count_rendered:,d} of {len(ids):,d} thumbnails in {collection}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Generate Thumbnails")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    ARGS = parser.parse_args()
+
+    # Validate..
+    assert ARGS.database in ("production", "development")
+
+    main(ARGS)
@@ -13,10 +13,14 @@ from mongoengine.context_managers import switch_collection
 
 import app.constants as c
 from app import create_app
+from app.blueprints.main.texts import request_text
 from app.cli import setup_logging
 from app.models import Rating
 from app.models.documents import Documents
 from app.models.users import Users
+from app.models.versions import bump_version
+from app.models.vocabularies import document_terms, rebuild_vocabulary, refresh_vocabulary
+from app.storage import delete_document_file, put_document_file
 
 
 def main(args: argparse.Namespace):
@@ -25,6 +29,7 @@ def main(args: argparse.Namespace):
 
     # Setup our application/db connection
     os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
     app = create_app(logging=False)
     with app.app_context():
         if args.action == "import_existing_pdfs":
@@ -40,9 +45,11 @@ def delete_():
     count = 0
     with switch_collection(Documents, Documents.as_user(user)) as user_documents:
         for doc in user_documents.objects(user=user):
-            doc.file_.delete()
+            delete_document_file(doc)
             doc.delete()
             count += 1
+    bump_version(Documents.as_user(user))
+    rebuild_vocabulary(Documents.as_user(user))
     print(f"Deleted {count} documents for {user.id=}")
 
 
@@ -172,8 +179,11 @@ def __import_raindrop(user, raindrop: dict) -> str:
 
         # Save the new "document"
         with open(raindrop["__path_pdf"], "rb") as fd:
-            doc.file_.put(fd, fileName=raindrop.get("__path_pdf").name, contentType="application/pdf")
+            put_document_file(doc, fd, raindrop.get("__path_pdf").name, "application/pdf")
         doc.save()
+    bump_version(Documents.as_user(user))
+    refresh_vocabulary(Documents.as_user(user), None, document_terms(doc))
+    request_text(user, doc)
 
     print("•", end="", flush=True)
 
@@ -13,10 +13,14 @@ from mongoengine.context_managers import switch_collection
 
 import app.constants as c
 from app import create_app
+from app.blueprints.main.texts import request_text
 from app.cli import setup_logging
 from app.models import Category, categories_available
 from app.models.documents import CategoryField, Documents
 from app.models.users import Users
+from app.models.versions import bump_version
+from app.models.vocabularies import document_terms, refresh_vocabulary
+from app.storage import put_document_file
 
 
 def main(args: argparse.Namespace):
@@ -25,6 +29,7 @@ def main(args: argparse.Namespace):
 
     # Setup our application/db connection
     os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
     app = create_app(logging=None)
     with app.app_context():
         if args.action == "1_create_toml":
@@ -84,9 +89,12 @@ def __import_pdf(user, o_category: Category, pdf: dict) -> str:
 
         path_pdf = Path(pdf.get("path"))
         with open(Path(path_pdf), "rb") as fd:
-            doc.file_.put(fd, fileName=path_pdf.name, contentType="application/pdf")
+            put_document_file(doc, fd, path_pdf.name, "application/pdf")
 
         doc.save()
+    bump_version(Documents.as_user(user, o_category))
+    refresh_vocabulary(Documents.as_user(user, o_category), None, document_terms(doc))
+    request_text(user, doc, Documents.as_user(user, o_category))
 
     time.sleep(0.25)
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Move the files of all documents to another blob store (eg. out of GridFS and into S3), in batches.
+
+Files not yet stored by content hash (ie. stored before we did so) are also re-stored within the
+same store, such that duplicates are shared, eg. "--to gridfs" de-duplicates existing GridFS files.
+
+Resumable, ie. documents already migrated are skipped, so simply re-run if interrupted.
+"""
+
+import argparse
+import datetime as dt
+import os
+import time
+
+from mongoengine.context_managers import switch_collection
+
+import app.constants as c
+from app import create_app
+from app.blueprints.main.texts import texts_collection
+from app.cli import setup_logging
+from app.models.documents import Documents
+from app.models.users import Users
+from app.models.versions import bump_version
+from app.storage import STORES, get_store, put_blob, release_blob
+from app.storage.base import BlocksReader
+
+
+def main(args: argparse.Namespace):
+    """Migrate the files across all document collections of all users."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
+    app = create_app(logging=None)
+    with app.app_context():
+        db = Documents._get_db()
+        for user in Users.objects():
+            for collection in sorted(db.list_collection_names(filter={"name": {"$regex": f"^documents-{user.id}-"}})):
+                migrate(collection, args.to, args.batch_size)
+
+
+def migrate(collection: str, to: str, batch_size: int) -> None:
+    """Move the files of the documents in the collection specified to the store specified, in batches of ids."""
+    get_store(to)  # (ie. fail now if it's not configured)
+    query = {
+        "$or": [
+            {"blob": {"$ne": None}, "blob.store": {"$ne": to}},  # In another store
+            {"blob": {"$ne": None}, "blob.sha256": None},  # Not (yet) stored by content hash
+            {"blob": None, "file_": {"$ne": None}},  # Legacy, ie. only a GridFS reference
+        ]
+    }
+    count_moved, count_bytes = 0, 0
+    print(f"Migrating: {collection} ", end="")
+    with switch_collection(Documents, collection) as user_documents:
+        coll = user_documents._get_collection()
+        ids = [son["_id"] for son in coll.find(query, {"_id": 1}).sort("_id")]
+        for offset in range(0, len(ids), batch_size):
+            for document in user_documents.objects(id__in=ids[offset : offset + batch_size]):
+                if not (existing := document.blob_ref) or (existing.store == to and existing.sha256):
+                    continue
+                # Keep the key and upload date across stores (ie. file links, thumbnails and texts stay current).
+                source = get_store(existing.store).open(existing)
+                try:
+                    stream = BlocksReader(source.read(0, source.length))
+                    blob = put_blob(stream, existing.filename, existing.content_type, store=to, original=existing)
+                finally:
+                    source.close()
+
+                # Only switch the document over if its file hasn't changed while we were copying it.
+                # (by key, as previews.py does, rather than comparing the entire embedded blob)
+                if document.blob:
+                    previous = {"blob.store": existing.store, "blob.key": existing.key}
+                else:
+                    previous = {"blob": None, "file_": document.file_.grid_id}
+                changes = {"blob": blob.to_mongo(), "updated": dt.datetime.utcnow()}
+                if blob.key != existing.key and document.thumbnail and document.thumbnail.source == existing.key:
+                    changes["thumbnail.source"] = blob.key  # (same content, ie. still its thumbnail)
+                result = coll.update_one({"_id": document.id, **previous}, {"$set": changes, "$unset": {"file_": ""}})
+                if result.modified_count:
+                    if blob.key != existing.key:
+                        texts_collection(collection).update_one(
+                            {"_id": document.id, "source": existing.key}, {"$set": {"source": blob.key}}
+                        )
+                    release_blob(existing)
+                    count_moved += 1
+                    count_bytes += blob.length
+                else:
+                    release_blob(blob)
+            print("•", end="", flush=True)
+            time.sleep(0.1)  # Don't hog the (remote) database.
+    if count_moved:
+        bump_version(collection)
+    print()
+    print(f"Moved {count_moved:,d} of {len(ids):,d} files ({count_bytes:,d} bytes) in {collection} to '{to}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Migrate Files Between Blob Stores")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    parser.add_argument(
+        "-t",
+        "--to",
+        help=f"Blob store to move all files to, ie. one of {', '.join(STORES)}.",
+        choices=STORES,
+        required=True,
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        help="Number of documents to migrate in each batch (default is 50).",
+        type=int,
+        default=50,
+    )
+
+    ARGS = parser.parse_args()
+
+    # Validate..
+    assert ARGS.database in ("production", "development")
+
+    main(ARGS)
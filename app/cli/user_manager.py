@@ -129,6 +129,7 @@ if __name__ == "__main__":
 
     # Setup our db connection
     os.environ["FLASK_ENV"] = ARGS.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. no job threads, they'd die with us mid-job)
     app = create_app()
     app.app_context().push()
 
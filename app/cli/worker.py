@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Run background jobs (see app/jobs.py), ie. as a separate process from the web processes."""
+
+import argparse
+import os
+import signal
+
+import app.constants as c
+from app import create_app
+from app.cli import setup_logging
+from app.jobs import KINDS, Worker, queue_status, requeue_abandoned
+
+
+def main(args: argparse.Namespace):
+    """Either show the status of the queue or run jobs until stopped (or drained)."""
+    setup_logging(True)
+
+    # Setup our application/db connection
+    os.environ["FLASK_ENV"] = args.database
+    os.environ["FLASK_JOB_THREADS"] = "0"  # (ie. we run our own threads, below)
+    app = create_app(logging=None)
+    with app.app_context():
+        if args.status:
+            requeue_abandoned()
+            for kind, counts in sorted(queue_status().items()):
+                print(f"{kind:16s} " + " ".join(f"{status}={count:,d}" for status, count in sorted(counts.items())))
+            return
+
+    worker = Worker(app, threads=args.threads, kinds=args.kinds, drain=args.drain)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())  # (eg. on deploy, finish what we're doing first)
+    print(f"Running {', '.join(args.kinds or sorted(KINDS))} jobs on {args.threads} thread(s)...")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoctioneLibri - Background Job Worker")
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        help=f"Database environment, eg. {', '.join(c.DB_ENVS)}. Default is 'development'.",
+        default="development",
+    )
+
+    parser.add_argument(
+        "-t",
+        "--threads",
+        help="Number of jobs to run at once (default is 2).",
+        type=int,
+        default=2,
+    )
+
+    parser.add_argument(
+        "-k",
+        "--kinds",
+        help="Kinds of jobs to run (default is all).",
+        nargs="*",
+    )
+
+    parser.add_argument(
+        "--drain",
+        help="Exit once there are no more jobs due (rather than waiting for more).",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--status",
+        help="Show the number of jobs of each kind by status (and exit).",
+        action="store_true",
+    )
+
+    ARGS = parser.parse_args()
+
+    # Validate..
+    assert ARGS.database in ("production", "development")
+
+    main(ARGS)
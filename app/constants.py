@@ -1,5 +1,7 @@
 """Constants."""
 
+import datetime as dt
+
 ###############################################################################
 # Logging infrastructure
 ###############################################################################
@@ -18,3 +20,42 @@ DB_ENVS = ("local", "production")
 COOKIE_NAME = "coctioni_libri"
 SORT_ASCENDING = "fa-sort-up"
 SORT_DESCENDING = "fa-sort-down"
+
+###############################################################################
+# Main table display
+###############################################################################
+PAGE_SIZE = 100  # Number of documents rendered on each "page" of the main table.
+LISTING_CACHE_SIZE = 256  # Number of slices/searches of the main table cached (per process).
+ROW_CACHE_SIZE = 10_000  # Number of rendered rows of the main table cached (per process).
+
+###############################################################################
+# Search engines available (see settings.toml: search_engine)
+###############################################################################
+SEARCH_ENGINE_SUBSTRING = "substring"  # Case-insensitive substring matching on title, source and tags.
+SEARCH_ENGINE_TEXT = "text"  # MongoDB text index, ie. stemming and relevance ranking.
+SEARCH_ENGINE_INDEX = "index"  # In-process inverted index, ie. prefix matching for search-as-you-type.
+
+###############################################################################
+# Chunked uploads (see app/blueprints/main/uploads.py and settings.toml)
+###############################################################################
+UPLOAD_MAX_BYTES = 64 * 1024 * 1024  # Default largest file we'll accept.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # Default size of each chunk (bar the last).
+UPLOAD_MAX_AGE = dt.timedelta(days=1)  # Age after which an unfinished upload is considered abandoned.
+
+###############################################################################
+# Previews (see app/blueprints/main/previews.py)
+###############################################################################
+THUMBNAIL_WIDTH = 160  # Width (in pixels) of the first-page thumbnail of each document's file.
+THUMBNAIL_QUALITY = 70  # JPEG quality of thumbnails.
+THUMBNAIL_JOB_LIMIT = 4  # Number of thumbnails rendered at once (across all workers).
+TEXT_JOB_LIMIT = 4  # Number of texts extracted at once (across all workers).
+TEXT_MAX_CHARS = 200_000  # Most text we keep (and index) from a single file.
+
+###############################################################################
+# Background jobs (see app/jobs.py)
+###############################################################################
+JOB_MAX_ATTEMPTS = 3  # Number of times a job is tried before it's considered failed.
+JOB_RETRY_DELAY = dt.timedelta(seconds=30)  # Delay before the first retry of a job (doubling thereafter).
+JOB_LEASE = dt.timedelta(minutes=10)  # Time a worker has to finish a job before it's considered abandoned.
+JOB_POLL_SECONDS = 2.0  # Time an idle worker waits before looking for jobs again.
+JOB_RETENTION = dt.timedelta(days=7)  # Time finished jobs are kept around (ie. for their status).
@@ -0,0 +1,231 @@
+"""Background jobs, ie. a durable (MongoDB-backed) queue of work done outside of requests.
+
+Expensive follow-up work (eg. rendering thumbnails) is queued as a job of a registered "kind"
+and run by workers, either:
+
+- A separate worker process (app/cli/worker.py, ie. poe worker), scaled independently of the web
+  processes, or
+- A few threads within each web process (see settings.toml: job_threads), ie. so that jobs still
+  run where there's no separate worker (eg. development). Set job_threads=0 once there is.
+
+Jobs are claimed atomically (so each is only run once at a time), retried with an increasing
+delay if they fail (up to max_attempts) and considered abandoned (and retried) if a worker
+doesn't finish one within its lease (eg. was killed). The number of jobs of each kind running
+at once across *all* workers can be limited (eg. cpu-hungry ones).
+"""
+
+import datetime as dt
+import logging as log
+import os
+import socket
+import threading
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from bson.objectid import ObjectId
+from flask import Flask
+
+import app.constants as c
+from app.models.jobs import DONE, FAILED, QUEUED, RUNNING, Jobs
+from app.models.users import Users
+
+
+@dataclass
+class JobKind:
+    """A kind of job, ie. the function doing it and how many may run at once (across all workers)."""
+
+    name: str
+    function: Callable[..., None]
+    limit: int | None = None
+
+
+KINDS: dict[str, JobKind] = {}
+
+_NEW_JOB = threading.Condition()  # Notified whenever this process queues a job
+
+
+def job(name: str, limit: int | None = None) -> Callable:
+    """Register the decorated function as the kind of job specified."""
+
+    def decorator(function: Callable[..., None]) -> Callable[..., None]:
+        KINDS[name] = JobKind(name, function, limit)
+        return function
+
+    return decorator
+
+
+################################################################################
+# Queueing (and querying)
+################################################################################
+def enqueue(
+    kind: str,
+    dedupe: str | None = None,
+    user: Users | None = None,
+    retry_failed: bool = True,
+    **args,
+) -> ObjectId:
+    """Queue a job of the kind specified (with the arguments specified), returning its id.
+
+    If a dedupe key is given and a job with the same key is already queued or running, that one's
+    id is returned instead, eg. to render a document's thumbnail once however many times it's asked
+    for (hence the key should identify the work, eg. include the file's key). Likewise one that's
+    failed (on every attempt) unless retry_failed. This is best-effort (eg. two processes could
+    queue the same job at once), hence jobs should be idempotent.
+    """
+    assert kind in KINDS, f"Sorry, unrecognised job kind: '{kind}'"
+    statuses = [QUEUED, RUNNING] if retry_failed else [QUEUED, RUNNING, FAILED]
+    if dedupe and (existing := Jobs.objects(dedupe=dedupe, status__in=statuses).only("id").first()):
+        return existing.id
+    job_ = Jobs(kind=kind, args=args, dedupe=dedupe, user=user).save()
+    with _NEW_JOB:
+        _NEW_JOB.notify()  # (ie. wake one of our own idle threads, if any)
+    return job_.id
+
+
+def get_job(job_id: str, user: Users | None = None) -> Jobs | None:
+    """Return the job specified (if it exists and, if a user is specified, it's theirs)."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    query = {"id": job_id} | ({"user": user} if user else {})
+    return Jobs.objects(**query).first()
+
+
+def queue_status() -> dict[str, dict[str, int]]:
+    """Return the number of jobs of each kind by status, eg. {"thumbnail": {"queued": 10, "running": 2}}."""
+    status = {}
+    pipeline = [{"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}}]
+    for group in Jobs._get_collection().aggregate(pipeline):
+        status.setdefault(group["_id"]["kind"], {})[group["_id"]["status"]] = group["count"]
+    return status
+
+
+################################################################################
+# Running
+################################################################################
+def claim(worker: str, kinds: Iterable[str]) -> Jobs | None:
+    """Claim (and return) the next job due of any of the kinds specified (unless none are or all are at their limit)."""
+    now = dt.datetime.utcnow()
+    kinds = [kind for kind in kinds if _has_capacity(KINDS[kind])]
+    if not kinds:
+        return None
+    return (
+        Jobs.objects(status=QUEUED, kind__in=kinds, run_after__lte=now)
+        .order_by("run_after")
+        .modify(
+            new=True,
+            set__status=RUNNING,
+            set__worker=worker,
+            set__lease_until=now + c.JOB_LEASE,
+            inc__attempts=1,
+        )
+    )
+
+
+def run(job_: Jobs) -> bool:
+    """Run the job specified, recording the outcome (and queueing a retry on failure). True if it succeeded."""
+    try:
+        KINDS[job_.kind].function(**job_.args)
+    except Exception as exc:
+        log.exception(f"Sorry, job {job_.id} ({job_.kind}) failed on attempt {job_.attempts}")
+        _finish(job_, error=f"{type(exc).__name__}: {exc}")
+        return False
+    _finish(job_)
+    return True
+
+
+def requeue_abandoned() -> int:
+    """Requeue (or fail, if out of attempts) all running jobs whose lease has expired, returning how many."""
+    now = dt.datetime.utcnow()
+    collection = Jobs._get_collection()
+    abandoned = {"status": RUNNING, "lease_until": {"$lt": now}}
+    failed = collection.update_many(
+        abandoned | {"$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+        {"$set": {"status": FAILED, "finished": now, "error": "Abandoned (no worker finished it in time)"}},
+    )
+    requeued = collection.update_many(abandoned, {"$set": {"status": QUEUED, "run_after": now}})
+    return failed.modified_count + requeued.modified_count
+
+
+def _finish(job_: Jobs, error: str | None = None) -> None:
+    """Record the outcome of the job's current attempt (only if it's still ours, ie. hasn't been abandoned)."""
+    now = dt.datetime.utcnow()
+    if error is None:
+        update = {"status": DONE, "finished": now, "error": None}
+    elif job_.attempts < job_.max_attempts:
+        update = {"status": QUEUED, "run_after": now + c.JOB_RETRY_DELAY * 2 ** (job_.attempts - 1), "error": error}
+    else:
+        update = {"status": FAILED, "finished": now, "error": error}
+    Jobs._get_collection().update_one(
+        {"_id": job_.id, "status": RUNNING, "worker": job_.worker},
+        {"$set": update, "$unset": {"worker": "", "lease_until": ""}},
+    )
+
+
+def _has_capacity(kind: JobKind) -> bool:
+    """Return True if we can start another job of the kind specified (a best-effort check of its limit)."""
+    return kind.limit is None or Jobs.objects(status=RUNNING, kind=kind.name).count() < kind.limit
+
+
+################################################################################
+# Workers
+################################################################################
+class Worker:
+    """Runs jobs on a number of threads, until stopped (or, if draining, there are none left)."""
+
+    def __init__(self, app: Flask, threads: int = 1, kinds: Iterable[str] | None = None, drain: bool = False):
+        self.app = app
+        self.threads = threads
+        self.kinds = list(kinds) if kinds else None
+        self.drain = drain
+        self.stopping = threading.Event()
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self) -> list[threading.Thread]:
+        """Start our threads (as daemons, ie. they don't keep the process alive), returning them."""
+        threads = [
+            threading.Thread(target=self._loop, name=f"jobs-{number}", daemon=True) for number in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self) -> None:
+        """Run until stopped (or drained), ie. from the foreground of a worker process."""
+        for thread in self.start():
+            while thread.is_alive():
+                thread.join(timeout=1.0)  # (ie. so that we still get KeyboardInterrupt)
+
+    def stop(self) -> None:
+        """Stop claiming new jobs (those running are finished)."""
+        self.stopping.set()
+
+    def _loop(self) -> None:
+        worker = f"{self.name}:{threading.current_thread().name}"
+        while not self.stopping.is_set():
+            # (a fresh app context for each job, ie. nothing cached on g, eg. collection versions, outlives it)
+            with self.app.app_context():
+                try:
+                    requeue_abandoned()
+                    job_ = claim(worker, self.kinds or list(KINDS))
+                except Exception:
+                    log.exception("Sorry, unable to claim a job")
+                    job_ = None
+                if job_:
+                    log.info(f"Running job {job_.id} ({job_.kind}, attempt {job_.attempts} of {job_.max_attempts})")
+                    run(job_)
+                    continue
+            if self.drain:
+                return
+            with _NEW_JOB:
+                _NEW_JOB.wait(c.JOB_POLL_SECONDS)
+
+
+def start_threads(app: Flask) -> None:
+    """Start the job threads of this (web) process, if configured (see settings.toml: job_threads).
+
+    Called from our app factory, ie. the threads poll for jobs from startup (whoever queued them);
+    cli commands opt out (with FLASK_JOB_THREADS=0) as their threads would die with them mid-job.
+    """
+    if threads := app.config.get("JOB_THREADS", 0):
+        Worker(app, threads=threads).start()
+        log.debug(f"...started {threads} job thread(s)")
@@ -2,10 +2,16 @@
 
 from __future__ import annotations
 
+import base64
+import json
+import logging as log
 from enum import IntEnum, StrEnum
 
+from bson.objectid import ObjectId
 from flask.wrappers import Request  # Typing
 
+import app.constants as c
+
 
 ################################################################################
 # Enumerators
@@ -77,3 +83,63 @@ class Sort:
         if request.values.get("sort_order"):
             instance.order = request.values.get("sort_order")
         return instance
+
+
+class Cursor:
+    """Encapsulate all semantics controlling (keyset) paging through the from/main page.
+
+    A cursor identifies the position *after* the last document rendered, ie. the sort in effect
+    and the sort value & id of that document. We also track which "segment" we're in: those
+    documents that have a value for the sort field come first and then those that don't.
+    """
+
+    POPULATED = "populated"  # Segment of documents that have a value for the sort field
+    EMPTY = "empty"  # "                            that don't
+
+    def __init__(self, sort: Sort):
+        self.sort = sort
+        self.segment = self.POPULATED  # Default values, ie. the very start of the table...
+        self.value = None  # "
+        self.id = None  # "
+        self.size = c.PAGE_SIZE
+
+    def is_first(self) -> bool:
+        return self.segment == self.POPULATED and self.id is None
+
+    def after(self, segment: str, value, id_: str) -> Cursor:
+        """Return a new cursor (with the same sort) positioned after the document specified."""
+        instance = Cursor(self.sort)
+        instance.segment, instance.value, instance.id = segment, value, str(id_)
+        return instance
+
+    def encode(self) -> str:
+        """Return an opaque (but url-safe) token representing this cursor."""
+        state = [self.sort.by, self.sort.order, self.segment, self.value, self.id]
+        return base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+    def __str__(self):
+        return f"Cursor: {self.sort} segment={self.segment} value={self.value} id={self.id}"
+
+    @classmethod
+    def decode(cls, token: str) -> Cursor:
+        """Return the cursor represented by the token (see encode), raising ValueError if it's not a valid one."""
+        state = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        if not isinstance(state, list) or len(state) != 5:  # noqa: PLR2004
+            raise ValueError("not a cursor")
+        sort = Sort()
+        sort.by, sort.order, segment, value, id_ = state
+        if segment not in (cls.POPULATED, cls.EMPTY) or (id_ is not None and not ObjectId.is_valid(id_)):
+            raise ValueError(f"invalid position: {segment=} {id_=}")
+        instance = cls(sort)
+        instance.segment, instance.value, instance.id = segment, value, id_
+        return instance
+
+    @classmethod
+    def factory(cls, request: Request):
+        """Return the cursor from the request (if we're continuing on from a previous one) or a new one."""
+        if token := request.values.get("cursor"):
+            try:
+                return cls.decode(token)
+            except (ValueError, TypeError) as exc:
+                log.error(f"Sorry, unable to decode cursor, starting from the top: '{token}' ({exc})")
+        return cls(Sort.factory(request))
@@ -0,0 +1,82 @@
+"""Blob reference counts, ie. each distinct file content is stored once and shared by all documents holding it.
+
+Blobs are keyed by store and content hash (sha256, computed as the file is streamed into the
+store), such that re-uploading (or re-importing) a file we already have costs only the metadata
+of the document referring to it. Since the counts live in the database, they hold across all
+processes (eg. gunicorn workers and cli commands).
+"""
+
+from collections import Counter
+
+from mongoengine import Document, EmbeddedDocumentField, IntField, StringField
+from pymongo import UpdateOne
+
+from app.models.documents import BlobRef
+
+
+class Blobs(Document):
+    """A single stored blob and the number of documents referring to it."""
+
+    id = StringField(primary_key=True)  # Store and content hash, eg. "gridfs:<sha256>"
+    blob = EmbeddedDocumentField(BlobRef, required=True)  # Reference to the blob as first stored
+    refs = IntField(required=True, default=0)  # Number of documents referring to the blob
+
+    meta = {"collection": "blobs"}
+
+
+def add_reference(blob_ref: BlobRef) -> BlobRef:
+    """Add a reference to the blob with the content of the one specified, returning the reference to use.
+
+    If we already have a blob with the same content, the reference returned is to *that* one (and
+    the blob specified is no longer needed), otherwise the blob specified becomes the shared one.
+    """
+    existing = Blobs.objects(id=_id(blob_ref)).modify(
+        upsert=True,
+        new=False,
+        inc__refs=1,
+        set_on_insert__blob=blob_ref,
+    )
+    if existing is None:
+        return blob_ref
+    shared = BlobRef(**existing.blob.to_mongo().to_dict())
+    shared.filename = blob_ref.filename  # (names and types are those of the upload, not the original)
+    shared.content_type = blob_ref.content_type
+    return shared
+
+
+def remove_reference(blob_ref: BlobRef) -> bool:
+    """Remove a reference to the blob specified, returning True if it was the last one (ie. the blob can go)."""
+    blob = Blobs.objects(id=_id(blob_ref)).modify(new=True, dec__refs=1)
+    if blob is None:
+        return True  # (never counted, eg. already removed)
+    if blob.refs > 0:
+        return False
+    # Only remove the count if nobody's re-added a reference in the meantime.
+    return Blobs._get_collection().delete_one({"_id": blob.id, "refs": {"$lte": 0}}).deleted_count == 1
+
+
+def remove_references(blob_refs: list[BlobRef]) -> list[BlobRef]:
+    """Remove a reference to each of the blobs specified (all at once), returning those whose last one it was.
+
+    The same as remove_reference for each, in two round-trips plus one per blob whose count reaches zero.
+    """
+    if not blob_refs:
+        return []
+    by_id = {_id(blob_ref): blob_ref for blob_ref in blob_refs}
+    collection = Blobs._get_collection()
+    collection.bulk_write(
+        [UpdateOne({"_id": id_}, {"$inc": {"refs": -count}}) for id_, count in Counter(map(_id, blob_refs)).items()],
+        ordered=False,
+    )
+    refs = {son["_id"]: son["refs"] for son in collection.find({"_id": {"$in": list(by_id)}}, {"refs": 1})}
+    last = [by_id[id_] for id_ in by_id if id_ not in refs]  # (never counted, eg. already removed)
+    # Only remove the counts that are still at zero when deleted (ie. the filter re-checks atomically that
+    # nobody's re-added a reference in the meantime), the last reference being ours only if we deleted it.
+    for id_ in (id_ for id_, count in refs.items() if count <= 0):
+        if collection.find_one_and_delete({"_id": id_, "refs": {"$lte": 0}}, projection={"_id": 1}):
+            last.append(by_id[id_])
+    return last
+
+
+def _id(blob_ref: BlobRef) -> str:
+    return f"{blob_ref.store}:{blob_ref.sha256}"
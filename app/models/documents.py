@@ -5,9 +5,14 @@ from zoneinfo import ZoneInfo
 
 import humanize
 from mongoengine import (
+    BinaryField,
     DateTimeField,
     Document,
+    EmbeddedDocument,
+    EmbeddedDocumentField,
     FileField,
+    FloatField,
+    IntField,
     ListField,
     ReferenceField,
     SortedListField,
@@ -20,6 +25,7 @@ from mongoengine.fields import BaseField
 
 from app.models import Category, RatingComplexity, RatingQuality
 from app.models.users import Users
+from app.models.vocabularies import get_vocabulary
 
 
 class RatingQualityField(BaseField):
@@ -76,6 +82,37 @@ class CategoryField(BaseField):
             raise errors.ValidationError(f"Invalid value for Category: {value=}") from exc
 
 
+class BlobRef(EmbeddedDocument):
+    """Reference to a document's file (ie. pdf) in one of our blob stores (see app.storage)."""
+
+    # fmt: off
+    store        = StringField(required=True)                                  # Store holding the file, eg. 'gridfs'
+    key          = StringField(required=True)                                  # Key of the file within the store
+    length       = IntField(required=True)                                     # Size of the file (in bytes)
+    content_type = StringField()                                               # Mime type, eg. 'application/pdf'
+    filename     = StringField()                                               # Original name of the file
+    md5          = StringField()                                               # Digest of the contents (if known)
+    sha256       = StringField()                                               # Content hash, if shared (see Blobs)
+    uploaded     = DateTimeField(required=True, default=dt.datetime.utcnow)    # Date stamp when stored
+    # fmt: on
+
+    def __str__(self):
+        return f"{self.store}:{self.key}"
+
+
+class Thumbnail(EmbeddedDocument):
+    """Preview image of the first page of a document's file (see app/blueprints/main/previews.py)."""
+
+    # fmt: off
+    source       = StringField(required=True)                # Key of the blob rendered, ie. stale if it's changed
+    data         = BinaryField()                             # Image itself (None if the file can't be rendered)
+    content_type = StringField(default="image/jpeg")         # Mime type of the image
+    # fmt: on
+
+
+_INDEXED: set[str] = set()  # Document collections we've ensured are indexed (in this process)
+
+
 class Documents(Document):
     """Base Documents."""
 
@@ -92,10 +129,12 @@ class Documents(Document):
     # Optional Fields
     ################################################################################
     # Generic (but optional) "document" fields, ie. common across all document categories:
-    file_        = FileField()                                 # GridFS link to actual pdf/file content
+    blob         = EmbeddedDocumentField(BlobRef)              # Reference to actual pdf/file content (see app.storage)
+    file_        = FileField()                                 # GridFS link to pdf/file content (legacy, see blob)
     notes        = StringField()                               # "Notes" in MD format
     source       = StringField()                               # Logical source of doc, e.g. NY, FN, etc.
     tags         = SortedListField(StringField(max_length=50)) # List of tags in "Titled" display format
+    thumbnail    = EmbeddedDocumentField(Thumbnail)            # Preview of the first page of the file (if rendered)
     updated      = DateTimeField()                             # When doc was last "touched"
     url_         = StringField(max_length=2038)                # URL associated with the document.
 
@@ -105,9 +144,51 @@ class Documents(Document):
     dates_cooked = ListField(DateTimeField()) # List "cooked" dates
     quality      = RatingQualityField(min_value=0, max_value=5, choices=[e.value for e in RatingQuality])
     complexity   = RatingComplexityField(min_value=0, max_value=5, choices=[e.value for e in RatingComplexity])
+
+    ################################################################################
+    # Derived Fields (ie. never set directly, maintained on save *and* on atomic updates
+    # by update_derived_fields) so that we can sort (and filter) on them in the database.
+    ################################################################################
+    tags_for_sort         = StringField()  # Lower-case, sorted, "|"-separated tags, eg. 'pasta|quick'
+    quality_by_complexity = FloatField()   # The bang for buck, ie. quality / complexity
+    times_cooked          = IntField()     # Number of times we've cooked this, ie. len(dates_cooked)
     # fmt: on
 
-    meta = {"indexes": ["tags"]}
+    meta = {
+        "indexes": [
+            "tags",
+            # Support database-side sorting of the main table (with "id" as tie-breaker to keep paging stable)
+            ("title", "id"),
+            ("source", "id"),
+            ("quality", "id"),
+            ("complexity", "id"),
+            ("tags_for_sort", "id"),
+            ("quality_by_complexity", "id"),
+            ("times_cooked", "id"),
+            # Support the (optional) text search engine, ie. stemmed search and relevance ranking
+            {
+                "fields": ["$title", "$tags", "$source", "$notes"],
+                "default_language": "english",
+                "weights": {"title": 10, "tags": 5, "source": 3, "notes": 1},
+            },
+        ],
+        # Every switch_collection resets our collection, ie. we'd otherwise issue a createIndexes for
+        # each of the indexes above on *every* use; instead, see _get_collection below.
+        "auto_create_index": False,
+    }
+
+    @classmethod
+    def _get_collection(cls):
+        """Return the current (ie. switched-to) collection, ensuring its indexes on first use in this process."""
+        collection = super()._get_collection()
+        if collection.name not in _INDEXED:
+            _INDEXED.add(collection.name)  # (first, as ensure_indexes itself gets the collection)
+            try:
+                cls.ensure_indexes()
+            except Exception:
+                _INDEXED.discard(collection.name)
+                raise
+        return collection
 
     @classmethod
     def pre_save(cls, sender, document, **kwargs):
@@ -115,6 +196,38 @@ class Documents(Document):
         if document.id:  # Only update "updated" if we're saving an existing document
             document.updated = dt.datetime.utcnow()
 
+        # Keep our derived fields in sync with those they're derived from:
+        if document.tags:
+            document.tags_for_sort = "|".join(tag.lower() for tag in sorted(document.tags))
+        else:
+            document.tags_for_sort = None
+        if document.quality is not None and document.complexity:
+            document.quality_by_complexity = document.quality / document.complexity
+        else:
+            document.quality_by_complexity = None
+        document.times_cooked = len(document.dates_cooked) if document.dates_cooked else None
+
+    @classmethod
+    def update_derived_fields(cls, query: dict) -> int:
+        """Recalculate our derived fields in the database for all documents in the (current) collection matching query.
+
+        This is the equivalent of our pre_save for those cases where we've done an atomic update
+        (eg. pull__tags=...) as an aggregation pipeline, ie. without a round-trip to get the documents.
+        Documents whose derived fields actually change also have "updated" set, as for any other write
+        (eg. rendered rows are cached by it).
+        """
+        unchanged = {
+            "$and": [
+                {"$eq": [{"$ifNull": [expression, None]}, {"$ifNull": [f"${name}", None]}]}
+                for name, expression in DERIVED_FIELDS.items()
+            ]
+        }
+        pipeline = [
+            {"$set": {"updated": {"$cond": [unchanged, "$updated", dt.datetime.utcnow()]}}},
+            {"$set": DERIVED_FIELDS},
+        ]
+        return cls._get_collection().update_many(query, pipeline).modified_count
+
     @property
     def quality_enum(self) -> RatingQuality | None:
         """Return the uptyped quality field as "Rating" instead of int."""
@@ -125,23 +238,6 @@ class Documents(Document):
         """Return the uptyped complexity field as "Rating" instead of int."""
         return RatingComplexity(self.complexity) if self.complexity else None
 
-    @property
-    def quality_by_complexity(self) -> float | None:
-        """Return the bang for buck, ie. quality / complexity."""
-        try:
-            return f"{self.quality / self.complexity:.2f}"
-        except TypeError:
-            return None
-
-    @property
-    def tags_for_sort(self) -> list[str] | None:
-        """Convert the list of tags to a lower-case, sorted comma-separated list."""
-        # This is only used for sorting documents by the "tags" column, NOT for display!
-        if not self.tags:
-            return None
-        normalised = [tag.lower() for tag in sorted(self.tags)]
-        return "|".join(normalised)
-
     @property
     def cooked(self) -> int:
         """Return number of times we've cooked this."""
@@ -152,11 +248,36 @@ class Documents(Document):
         """Return created attr in local and nicely formatted."""
         return dt_as_local(self.created)
 
+    @property
+    def blob_ref(self) -> BlobRef | None:
+        """Return the reference to the document's file (if any), including those still in our legacy file_ field."""
+        if self.blob:
+            return self.blob
+        if self.file_ and (grid_out := self.file_.get()):
+            return BlobRef(
+                store="gridfs",
+                key=str(grid_out._id),
+                length=grid_out.length,
+                content_type=grid_out.content_type,
+                filename=grid_out.filename,
+                uploaded=grid_out.upload_date,
+            )
+        return None
+
+    @property
+    def file_key(self) -> str | None:
+        """Return the key of the document's file (if any), ie. without having to look up a legacy file_ in GridFS."""
+        if self.blob:
+            return self.blob.key
+        if self.file_ and self.file_.grid_id:
+            return str(self.file_.grid_id)
+        return None
+
     @property
     def filesize_display(self) -> str | None:
-        """Return the filesize of the current document in human-readable format (if file_ defined)."""
-        if self.file_:
-            return humanize.naturalsize(self.file_.length)
+        """Return the filesize of the current document in human-readable format (if it has a file)."""
+        if blob_ref := self.blob_ref:
+            return humanize.naturalsize(blob_ref.length)
         return ""
 
     @property
@@ -164,13 +285,6 @@ class Documents(Document):
         """Return updated attr in local and nicely formatted if available."""
         return dt_as_local(self.updated) if self.updated else ""
 
-    @property
-    def times_cooked(self) -> str | None:
-        """Return the number of times we've cooked this."""
-        if self.dates_cooked:
-            return str(len(self.dates_cooked))
-        return None
-
     @property
     def dates_cooked_display(self) -> list[str]:
         """Return a list of tuples of dates last cooked, eg. [("2024-02-01", "Monday, February 2nd 2024")...]."""
@@ -187,6 +301,80 @@ class Documents(Document):
         return f"documents-{user.id}-{o_category.collection_root}"
 
 
+class DocumentRow:
+    """Lightweight (read-only) row of the main table, ie. just what's needed to render it.
+
+    Built directly from the raw (pymongo) projection of a document, ie. without the cost
+    of constructing a full MongoEngine `Documents` instance, with all display values
+    calculated once up-front (rather than on every property access from the template).
+    """
+
+    # Fields projected from the database to create a row.
+    # fmt: off
+    FIELDS = (
+        "title", "tags", "source", "quality", "complexity", "quality_by_complexity", "times_cooked", "updated",
+        "blob.key", "file_",
+    )
+    # fmt: on
+
+    __slots__ = (
+        "complexity_display",
+        "file_key",
+        "id",
+        "quality_by_complexity_display",
+        "quality_display",
+        "source",
+        "tags",
+        "times_cooked_display",
+        "title",
+        "updated",
+    )
+
+    def __init__(self, son: dict):
+        quality, complexity = son.get("quality"), son.get("complexity")
+        quality_by_complexity = son.get("quality_by_complexity")
+        self.id = son["_id"]
+        self.title = son.get("title")
+        self.tags = sorted(son.get("tags") or [])
+        self.source = son.get("source") or ""
+        self.quality_display = str(RatingQuality(quality)) if quality else ""
+        self.complexity_display = str(RatingComplexity(complexity)) if complexity else ""
+        self.quality_by_complexity_display = f"{quality_by_complexity:.2f}" if quality_by_complexity is not None else ""
+        self.times_cooked_display = str(son["times_cooked"]) if son.get("times_cooked") else ""
+        self.updated = son.get("updated")  # (ie. the "version" of the row, see render_row)
+        # Key of the document's file (if any) in its store, ie. the "version" of the file (see send_stored_file)
+        file_key = (son.get("blob") or {}).get("key") or son.get("file_")
+        self.file_key = str(file_key) if file_key else None
+
+
+# fmt: off
+# Database-side equivalents of our derived fields (see pre_save), ie. for use in update pipelines.
+DERIVED_FIELDS = {
+    "tags_for_sort"         : {
+        "$cond": [
+            {"$gt": [{"$size": {"$ifNull": ["$tags", []]}}, 0]},
+            {"$reduce": {
+                "input"        : {"$sortArray": {"input": "$tags", "sortBy": 1}},
+                "initialValue" : None,
+                "in"           : {"$cond": [
+                    {"$eq": ["$$value", None]},
+                    {"$toLower": "$$this"},
+                    {"$concat": ["$$value", "|", {"$toLower": "$$this"}]},
+                ]},
+            }},
+            None,
+        ],
+    },
+    "quality_by_complexity" : {
+        "$cond": [{"$gt": ["$complexity", 0]}, {"$divide": ["$quality", "$complexity"]}, None],
+    },
+    "times_cooked"          : {
+        "$cond": [{"$gt": [{"$size": {"$ifNull": ["$dates_cooked", []]}}, 0]}, {"$size": "$dates_cooked"}, None],
+    },
+}
+# fmt: on
+
+
 ################################################################################
 # Signal support (similar do django signals ;-)!)
 ################################################################################
@@ -224,19 +412,9 @@ def dt_as_date(datetime_naive: dt.datetime) -> str:
 
 def sources_available(user: Users) -> list[str]:
     """Return the current list of sources across all documents as a Choice list."""
-    sources_available = []
-    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        docs = user_documents.objects(source__ne=None).only("source")
-        sources = sorted({doc.source for doc in docs})
-        sources_available.extend(sources)
-    return sources_available
+    return get_vocabulary(Documents.as_user(user), "source")
 
 
 def tags_available(user: Users) -> list[str]:
     """Return a sorted list of all current tags (ie. those attached to documents)."""
-    tags = set()
-    with switch_collection(Documents, Documents.as_user(user)) as user_documents:
-        for document in user_documents.objects(tags__ne=None).only("tags"):
-            for tag in document.tags:
-                tags.add(tag)
-    return sorted(tags)
+    return get_vocabulary(Documents.as_user(user), "tags")
@@ -0,0 +1,56 @@
+"""Background job model, ie. a durable queue of work to be done outside of requests (see app/jobs.py)."""
+
+import datetime as dt
+
+from mongoengine import DateTimeField, DictField, Document, IntField, ReferenceField, StringField
+
+import app.constants as c
+from app.models.users import Users
+
+# fmt: off
+QUEUED  = "queued"   # Waiting for a worker (possibly until run_after, eg. a retry)
+RUNNING = "running"  # Claimed by a worker (until lease_until, after which it's considered abandoned)
+DONE    = "done"     # Completed successfully
+FAILED  = "failed"   # Failed on every attempt
+# fmt: on
+
+
+class Jobs(Document):
+    """A single background job."""
+
+    # fmt: off
+    kind         = StringField(required=True)                               # What to do, eg. 'thumbnail'
+    args         = DictField()                                              # Keyword arguments to do it with
+    dedupe       = StringField()                                            # Only one job per key is queued at once
+    user         = ReferenceField(Users)                                    # Who the job is on behalf of (if anyone)
+    status       = StringField(required=True, default=QUEUED)               # One of the statuses above
+    attempts     = IntField(required=True, default=0)                       # Number of times we've started it
+    max_attempts = IntField(required=True, default=c.JOB_MAX_ATTEMPTS)      # Number of times we'll try it
+    run_after    = DateTimeField(required=True, default=dt.datetime.utcnow) # Not to be started before
+    worker       = StringField()                                            # Worker running it, eg. 'host:pid:thread'
+    lease_until  = DateTimeField()                                          # When a running job is abandoned
+    error        = StringField()                                            # Error of the most recent attempt
+    created      = DateTimeField(required=True, default=dt.datetime.utcnow) # Date stamp when queued
+    finished     = DateTimeField()                                          # Date stamp when done (or failed)
+    # fmt: on
+
+    meta = {
+        "collection": "jobs",
+        "indexes": [
+            ("status", "kind", "run_after"),
+            ("dedupe", "status"),
+            {"fields": ["finished"], "expireAfterSeconds": int(c.JOB_RETENTION.total_seconds())},
+        ],
+    }
+
+    def as_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created": self.created.isoformat(),
+            "finished": self.finished.isoformat() if self.finished else None,
+        }
@@ -0,0 +1,83 @@
+"""Upload session model, ie. a (large) file being uploaded to a document in numbered chunks.
+
+Chunks can arrive in any order (and be re-sent), such that a client can resume an interrupted
+upload by asking which chunks we already have and only sending the rest. Once finalized, the
+file is assembled by a background job, with the session showing the outcome (see
+app/blueprints/main/uploads.py).
+"""
+
+import datetime as dt
+
+from mongoengine import (
+    DateTimeField,
+    DictField,
+    Document,
+    EmbeddedDocumentField,
+    IntField,
+    ObjectIdField,
+    ReferenceField,
+    StringField,
+)
+
+from app.models.documents import BlobRef
+from app.models.users import Users
+
+# fmt: off
+RECEIVING  = "receiving"   # Waiting for (more) chunks and to be finalized
+ASSEMBLING = "assembling"  # Finalized, ie. the file is being stored from its chunks (by a job)
+DONE       = "done"        # Stored as the document's file
+FAILED     = "failed"      # Couldn't be stored (see error), eg. re-send the chunk(s) and finalize again
+# fmt: on
+
+
+class Uploads(Document):
+    """A single upload session."""
+
+    # fmt: off
+    user         = ReferenceField(Users, required=True)                     # FK to user
+    collection   = StringField(required=True)                               # Collection of the document
+    doc_id       = ObjectIdField(required=True)                             # Document the file is for
+    filename     = StringField(required=True)                               # Name of the file (cleansed)
+    content_type = StringField()                                            # Mime type, eg. 'application/pdf'
+    length       = IntField(required=True, min_value=1)                     # Size of the entire file (in bytes)
+    chunk_size   = IntField(required=True, min_value=1)                     # Size of each chunk (bar the last)
+    received     = DictField()                                              # Chunks received, number -> {id, sha256}
+    status       = StringField(required=True, default=RECEIVING)            # One of the statuses above
+    sha256       = StringField()                                            # Of the entire file (if given to finalize)
+    job          = ObjectIdField()                                          # Job assembling the file (once finalized)
+    error        = StringField()                                            # Why the file couldn't be stored
+    blob         = EmbeddedDocumentField(BlobRef)                           # File stored (once done)
+    created      = DateTimeField(required=True, default=dt.datetime.utcnow) # Date stamp when started
+    # fmt: on
+
+    meta = {"collection": "uploads", "indexes": ["created"]}
+
+    @property
+    def count_chunks(self) -> int:
+        """Return the number of chunks making up the entire file."""
+        return -(-self.length // self.chunk_size)
+
+    def chunk_length(self, number: int) -> int:
+        """Return the size of the chunk specified (ie. all are chunk_size, other than the last)."""
+        return min(self.chunk_size, self.length - number * self.chunk_size)
+
+    @property
+    def missing(self) -> list[int]:
+        """Return the numbers of the chunks we've yet to receive."""
+        return [number for number in range(self.count_chunks) if str(number) not in self.received]
+
+    def as_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "doc_id": str(self.doc_id),
+            "filename": self.filename,
+            "length": self.length,
+            "chunk_size": self.chunk_size,
+            "count_chunks": self.count_chunks,
+            "received": {int(number): chunk["sha256"] for number, chunk in self.received.items()},
+            "missing": self.missing,
+            "status": self.status,
+            "job": str(self.job) if self.job else None,
+            "error": self.error,
+            "file": {"length": self.blob.length, "sha256": self.blob.sha256} if self.blob else None,
+        }
@@ -0,0 +1,47 @@
+"""Collection version model, ie. a change counter for each document collection.
+
+Every write to a document collection (eg. "documents-<userId>-recipes") bumps its version, such
+that anything derived from the collection (cached listings, search indices etc.) can tell whether
+it's still current. Since the counters live in the database, this holds across all processes
+(eg. gunicorn workers and cli commands).
+"""
+
+from flask import g, has_app_context
+from mongoengine import Document, IntField, StringField
+
+
+class Versions(Document):
+    """Current version of a single document collection."""
+
+    collection = StringField(primary_key=True)  # Name of the collection, eg. "documents-<userId>-recipes"
+    version = IntField(required=True, default=0)  # Monotonically increasing on every change
+
+    meta = {"collection": "versions"}
+
+
+def get_version(collection: str) -> int:
+    """Return the current version of the collection specified (0 if it's never been changed).
+
+    Versions are cached for the duration of a request, ie. so that we only ask the database once.
+    """
+    cache = _request_cache()
+    if collection not in cache:
+        version = Versions.objects(collection=collection).only("version").first()
+        cache[collection] = version.version if version else 0
+    return cache[collection]
+
+
+def bump_version(collection: str) -> int:
+    """Bump (and return the new) version of the collection specified, ie. after *any* change to it."""
+    version = Versions.objects(collection=collection).modify(upsert=True, new=True, inc__version=1)
+    _request_cache()[collection] = version.version
+    return version.version
+
+
+def _request_cache() -> dict[str, int]:
+    """Return our per-request cache of versions (or an empty one if outside a request, eg. from the cli)."""
+    if not has_app_context():
+        return {}
+    if "versions" not in g:
+        g.versions = {}
+    return g.versions
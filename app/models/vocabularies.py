@@ -0,0 +1,88 @@
+"""Vocabulary model, ie. the distinct tags and sources in use in each document collection (with their counts).
+
+The edit page offers every tag and source in use as pulldown options; rather than scanning the
+entire collection for them on every edit, we maintain them: built once from the collection (on
+first use) and thereafter refreshed for just the values a write could have changed, ie. the
+tags/sources added to or removed from a document or renamed across all of them.
+
+Refreshing a value simply (re)counts the documents with it (an index lookup), so concurrent
+writers converge on the right counts rather than accumulating drift.
+"""
+
+import datetime as dt
+from collections import Counter
+from collections.abc import Iterable
+
+from mongoengine import DateTimeField, DictField, Document, ListField, StringField
+
+FIELDS = ("tags", "source")  # Document fields we maintain a vocabulary of.
+
+Terms = dict[str, set[str]]  # Values of each of our fields, eg. {"tags": {"Thai", "Soup"}, "source": {"NYT"}}
+
+
+class Vocabularies(Document):
+    """Vocabulary of a single document collection, each field a list of {"v": value, "n": count of documents}."""
+
+    collection = StringField(primary_key=True)  # Name of the collection, eg. "documents-<userId>-recipes"
+    tags = ListField(DictField())  # Tags in use, eg. [{"v": "Thai", "n": 12}, ...]
+    source = ListField(DictField())  # Sources in use, eg. [{"v": "NYT", "n": 3}, ...]
+    built = DateTimeField()  # When (re)built from the collection
+
+    meta = {"collection": "vocabularies"}
+
+
+def get_vocabulary(collection: str, field: str) -> list[str]:
+    """Return the sorted values of the field in use across the collection specified."""
+    son = Vocabularies._get_collection().find_one({"_id": collection}, {field: 1})
+    if son is None:
+        son = rebuild_vocabulary(collection)
+    return sorted(entry["v"] for entry in son.get(field, []))
+
+
+def document_terms(document) -> Terms:
+    """Return the values of our fields on the document specified (anything with tags and source attributes)."""
+    return {
+        "tags": set(document.tags or []),
+        "source": {document.source} if document.source else set(),
+    }
+
+
+def refresh_vocabulary(collection: str, before: Terms | None, after: Terms | None) -> None:
+    """Refresh the vocabulary of the collection for the values changed, ie. from before to after a write.
+
+    For a single document, these are its terms before and after (or nothing if created/deleted),
+    for bulk changes, the values affected (eg. {"tags": {old}} to {"tags": {new}} on a rename).
+    """
+    before, after = before or {}, after or {}
+    for field in FIELDS:
+        if changed := before.get(field, set()) ^ after.get(field, set()):
+            _refresh_values(collection, field, changed)
+
+
+def rebuild_vocabulary(collection: str) -> dict:
+    """Rebuild (and return) the vocabulary of the collection specified from all its documents."""
+    counts = {field: Counter() for field in FIELDS}
+    for son in Vocabularies._get_db()[collection].find({}, {"tags": 1, "source": 1}):
+        counts["tags"].update(set(son.get("tags") or []))
+        if son.get("source"):
+            counts["source"][son["source"]] += 1
+    vocabulary = {field: [{"v": value, "n": count} for value, count in counts[field].items()] for field in FIELDS}
+    vocabulary["built"] = dt.datetime.utcnow()
+    Vocabularies._get_collection().replace_one({"_id": collection}, vocabulary, upsert=True)
+    return vocabulary
+
+
+def _refresh_values(collection: str, field: str, values: Iterable[str]) -> None:
+    """Recount the documents with each of the values specified, replacing their entries in the vocabulary."""
+    values = list(values)
+    entries = []
+    for value in values:
+        if count := Vocabularies._get_db()[collection].count_documents({field: value}):
+            entries.append({"v": {"$literal": value}, "n": count})
+    # (values are $literal, else eg. a source of "$title" would be read as a field path)
+    keep = {"$filter": {"input": f"${field}", "cond": {"$eq": [{"$in": ["$$this.v", {"$literal": values}]}, False]}}}
+    # (if the vocabulary hasn't been built yet, there's nothing to refresh, it'll be built from scratch on first use)
+    Vocabularies._get_collection().update_one(
+        {"_id": collection},
+        [{"$set": {field: {"$concatArrays": [{"$ifNull": [keep, []]}, entries]}}}],
+    )
@@ -0,0 +1,182 @@
+"""Blob storage, ie. where the files (pdf's) of our documents live.
+
+Documents refer to their file through a BlobRef (store and key), such that files can live in any
+of our stores: GridFS (as they always have), the local filesystem or an S3-compatible object store.
+New files go to the store configured (see settings.toml: blob_store), existing ones stay where
+they are until moved (see app/cli/migrate_blobs.py).
+
+Blobs are content-addressed, ie. stored once per distinct content and shared (with a count of
+references, see app/models/blobs.py) by every document holding the same file.
+"""
+
+import logging as log
+from collections import defaultdict
+from pathlib import Path
+from typing import BinaryIO
+
+from flask import current_app
+
+from app.jobs import enqueue, job
+from app.models.blobs import add_reference, remove_reference, remove_references
+from app.models.documents import BlobRef, Documents
+from app.storage.base import BlobStore, FileSource
+from app.storage.cache import file_cache
+from app.storage.gridfs_store import GridFSStore
+from app.storage.local_store import LocalStore
+
+STORE_GRIDFS = "gridfs"
+STORE_LOCAL = "local"
+STORE_S3 = "s3"
+STORES = (STORE_GRIDFS, STORE_LOCAL, STORE_S3)
+
+_STORES: dict[str, BlobStore] = {}
+
+
+def get_store(name: str | None = None) -> BlobStore:
+    """Return the blob store specified (or the one configured for new files if none)."""
+    name = name or current_app.config.get("BLOB_STORE", STORE_GRIDFS)
+    if name not in _STORES:
+        config = current_app.config
+        if name == STORE_GRIDFS:
+            _STORES[name] = GridFSStore()
+        elif name == STORE_LOCAL:
+            _STORES[name] = LocalStore(Path(config.get("BLOB_LOCAL_DIR")).expanduser())
+        elif name == STORE_S3:
+            from app.storage.s3_store import S3Store  # (ie. only if we need it, as boto3 is optional)
+
+            _STORES[name] = S3Store(
+                config.get("BLOB_S3_BUCKET"),
+                prefix=config.get("BLOB_S3_PREFIX", ""),
+                endpoint_url=config.get("BLOB_S3_ENDPOINT_URL"),
+            )
+        else:
+            raise ValueError(f"Sorry, unrecognised blob store: '{name}' (should be one of {', '.join(STORES)})")
+    return _STORES[name]
+
+
+################################################################################
+# Document file operations
+################################################################################
+def put_document_file(document: Documents, stream: BinaryIO, filename: str | None, content_type: str | None) -> None:
+    """Store the contents of the stream as the document's file, replacing (and deleting) any existing one.
+
+    Note: the document itself isn't saved, that's the responsibility of the caller.
+    """
+    set_document_file(document, put_blob(stream, filename, content_type))
+
+
+def set_document_file(document: Documents, blob_ref: BlobRef) -> None:
+    """Set the document's file to the (newly referenced) blob specified, releasing any existing one.
+
+    Note: the document itself isn't saved, that's the responsibility of the caller.
+    """
+    existing = document.blob_ref
+    document.blob = blob_ref
+    document.file_ = None
+    document.thumbnail = None
+    if existing:
+        release_blob(existing)
+
+
+def delete_document_file(document: Documents) -> None:
+    """Delete the document's file (if it has one).
+
+    Note: the document itself isn't saved, that's the responsibility of the caller.
+    """
+    if existing := document.blob_ref:
+        release_blob(existing)
+    document.blob = None
+    document.file_ = None
+    document.thumbnail = None
+
+
+################################################################################
+# Blob operations
+################################################################################
+def put_blob(
+    stream: BinaryIO,
+    filename: str | None,
+    content_type: str | None,
+    store: str | None = None,
+    original: BlobRef | None = None,
+) -> BlobRef:
+    """Store the contents of the stream (unless we already have them), returning a new reference to the blob.
+
+    As we only know the content hash once the entire stream has been read, the contents are
+    always written, but a duplicate is deleted again straight away in favour of the original.
+    If the stream is that of an original blob (eg. being moved from another store), its key (if
+    free in this store) and upload date are kept.
+    """
+    store_ = get_store(store)
+    key = original.key if original and original.store != store_.name else None
+    blob_ref = store_.put(stream, filename, content_type, key=key)
+    if original:
+        blob_ref.uploaded = original.uploaded
+    shared = add_reference(blob_ref)
+    if shared.key != blob_ref.key:
+        store_.delete(blob_ref)
+        log.debug(f"Stored {filename=} as duplicate of {shared} ({shared.length:,d} bytes)")
+    else:
+        log.debug(f"Stored {filename=} as {shared} ({shared.length:,d} bytes)")
+    return shared
+
+
+def release_blob(blob_ref: BlobRef) -> None:
+    """Release a reference to the blob specified, deleting it if it was the last one."""
+    if blob_ref.sha256 and not remove_reference(blob_ref):
+        log.debug(f"Kept {blob_ref}, still referenced")
+        return
+    delete_blob(blob_ref)
+
+
+def release_blobs(blob_refs: list[BlobRef], background: bool = False) -> None:
+    """Release a reference to each of the blobs specified, deleting (in bulk) those whose last one it was.
+
+    If specified, this is done by a background job, eg. so that deleting hundreds of documents
+    doesn't wait on their files (which are simply orphaned until then).
+    """
+    if not blob_refs:
+        return
+    if background:
+        enqueue("release_blobs", blobs=[blob_ref.to_mongo().to_dict() for blob_ref in blob_refs])
+        return
+    uncounted = [blob_ref for blob_ref in blob_refs if not blob_ref.sha256]
+    delete_blobs(uncounted + remove_references([blob_ref for blob_ref in blob_refs if blob_ref.sha256]))
+
+
+@job("release_blobs")
+def release_blobs_job(blobs: list[dict]) -> None:
+    """Release the blobs specified (see release_blobs), ie. as a background job."""
+    release_blobs([BlobRef._from_son(blob) for blob in blobs])
+
+
+def delete_blob(blob_ref: BlobRef) -> None:
+    """Delete the blob specified from its store and our local cache."""
+    if cache := file_cache():
+        cache.remove(blob_ref)
+    get_store(blob_ref.store).delete(blob_ref)
+
+
+def delete_blobs(blob_refs: list[BlobRef]) -> None:
+    """Delete the blobs specified from their stores (in bulk, by store) and our local cache."""
+    by_store = defaultdict(list)
+    cache = file_cache()
+    for blob_ref in blob_refs:
+        if cache:
+            cache.remove(blob_ref)
+        by_store[blob_ref.store].append(blob_ref)
+    for store, refs in by_store.items():
+        get_store(store).delete_many(refs)
+        log.debug(f"Deleted {len(refs):,d} blobs from {store}")
+
+
+def open_document_file(document: Documents) -> FileSource | None:
+    """Return the source of the document's file (if it has one), ie. our local copy if we have one."""
+    if not (blob_ref := document.blob_ref):
+        return None
+    store = get_store(blob_ref.store)
+    if store.is_local or not (cache := file_cache()):
+        return store.open(blob_ref)
+    if source := cache.get(blob_ref):
+        return source
+    return cache.filling(blob_ref, store.open(blob_ref))
@@ -0,0 +1,190 @@
+"""Blob storage abstractions, ie. what every store provides and what we serve files from."""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+from werkzeug.wsgi import wrap_file
+
+from app.models.documents import BlobRef
+
+BLOCK_SIZE = 256 * 1024  # Size of blocks read/written (about that of a GridFS chunk).
+
+
+################################################################################
+# Sources of file contents (ie. what we serve files from)
+################################################################################
+class FileSource(ABC):
+    """A stored file, ie. its metadata and a means to read (ranges of) its contents."""
+
+    def __init__(self, key: str, length: int, content_type: str, md5: str | None, upload_date: dt.datetime):
+        self.key = key
+        self.length = length
+        self.content_type = content_type
+        self.md5 = md5
+        self.upload_date = upload_date
+
+    @property
+    def version(self) -> str:
+        """Return the version of the file, ie. unique to its key and content (digest if we have one)."""
+        return f"{self.key}-{self.md5 or self.length}"
+
+    @property
+    def modified(self) -> dt.datetime:
+        """Return when the file was uploaded (in UTC and to the second, as per HTTP dates)."""
+        return self.upload_date.replace(tzinfo=dt.UTC, microsecond=0)
+
+    @abstractmethod
+    def read(self, start: int, length: int) -> Iterator[bytes]:
+        """Yield length bytes of the file from start, a block at a time."""
+
+    def body(self, environ: dict) -> Iterable[bytes]:
+        """Return the entire contents of the file as a response body."""
+        return self.read(0, self.length)
+
+    def close(self) -> None:  # noqa: B027 (ie. optional, most sources hold nothing open)
+        """Release anything held open by this source."""
+
+    def as_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "length": self.length,
+            "content_type": self.content_type,
+            "md5": self.md5,
+            "upload_date": self.upload_date.isoformat(),
+        }
+
+    @classmethod
+    def metadata(cls, blob_ref: BlobRef) -> dict:
+        """Return the metadata of a source for the blob reference specified (as keyword arguments)."""
+        return {
+            "key": blob_ref.key,
+            "length": blob_ref.length,
+            "content_type": blob_ref.content_type,
+            "md5": blob_ref.md5,
+            "upload_date": blob_ref.uploaded,
+        }
+
+
+class LocalFileSource(FileSource):
+    """A file on local disk (optionally already open, eg. so it can still be read if it's removed meanwhile)."""
+
+    def __init__(self, path: Path, fh: BinaryIO | None = None, **metadata):
+        super().__init__(**metadata)
+        self.path = path
+        self.fh = fh
+
+    def read(self, start: int, length: int) -> Iterator[bytes]:
+        fh = self.fh or self.path.open("rb")
+        try:
+            offset, stop = start, start + length
+            while offset < stop and (block := os.pread(fh.fileno(), min(BLOCK_SIZE, stop - offset), offset)):
+                offset += len(block)
+                yield block
+        finally:
+            if fh is not self.fh:
+                fh.close()
+
+    def body(self, environ: dict) -> Iterable[bytes]:
+        """Return the entire file as a response body, ie. through the server's file wrapper (for sendfile)."""
+        return wrap_file(environ, self.fh or self.path.open("rb"), BLOCK_SIZE)
+
+    def close(self) -> None:
+        if self.fh:
+            self.fh.close()
+
+    @classmethod
+    def factory(cls, path: Path, metadata: dict, fh: BinaryIO | None = None) -> LocalFileSource:
+        """Create a new instance from metadata as returned by as_dict."""
+        return cls(
+            path,
+            fh,
+            key=metadata["key"],
+            length=metadata["length"],
+            content_type=metadata["content_type"],
+            md5=metadata["md5"],
+            upload_date=dt.datetime.fromisoformat(metadata["upload_date"]),
+        )
+
+
+################################################################################
+# Stores
+################################################################################
+class BlobStore(ABC):
+    """Somewhere we can put, read and delete blobs (ie. the pdf's/files of our documents)."""
+
+    name: str  # Name of the store as recorded on each BlobRef, eg. "gridfs"
+    is_local: bool = False  # Are blobs on local disk already? (ie. no point caching them locally)
+
+    @abstractmethod
+    def put(
+        self,
+        stream: BinaryIO,
+        filename: str | None,
+        content_type: str | None,
+        key: str | None = None,
+    ) -> BlobRef:
+        """Store the contents of the stream, returning the reference to it (under the key specified, if any)."""
+
+    @abstractmethod
+    def open(self, blob_ref: BlobRef) -> FileSource:
+        """Return the source of the blob specified (ie. to read it)."""
+
+    @abstractmethod
+    def delete(self, blob_ref: BlobRef) -> None:
+        """Delete the blob specified (if it's still there)."""
+
+    def delete_many(self, blob_refs: list[BlobRef]) -> None:
+        """Delete all the blobs specified (if still there), ie. in bulk if the store supports it."""
+        for blob_ref in blob_refs:
+            self.delete(blob_ref)
+
+
+class HashingReader:
+    """Wrap a binary stream, keeping track of the length and digests of what's been read from it."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.length = 0
+        self.digest_md5 = hashlib.md5(usedforsecurity=False)
+        self.digest_sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.length += len(data)
+        self.digest_md5.update(data)
+        self.digest_sha256.update(data)
+        return data
+
+    @property
+    def md5(self) -> str:
+        return self.digest_md5.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        return self.digest_sha256.hexdigest()
+
+
+class BlocksReader:
+    """Wrap an iterator of blocks (eg. of a file source) as a (read-only) binary stream, eg. to put it into a store."""
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self.blocks = blocks
+        self.buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            if (block := next(self.blocks, None)) is None:
+                break
+            self.buffer += block
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
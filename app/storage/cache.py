@@ -0,0 +1,163 @@
+"""Local, on-disk, read-through cache of files from our (remote) blob stores, ie. GridFS or S3.
+
+Entries are keyed by blob reference (ie. store and key): since blobs are never changed (only
+replaced by a new blob with a new key), a cached copy can never be stale, it can only be orphaned
+(which is why we remove the entries of files replaced or deleted).
+
+The cache is shared by all worker processes on this machine:
+
+- Files are written to a temporary file first and atomically renamed into place once complete
+  (content then metadata, the latter being the "commit"), ie. readers never see partial files.
+- Each read "touches" the file's modification time, such that eviction (ie. when we're over our
+  byte budget) removes the least recently used files first; only one process evicts at a time.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import logging as log
+import os
+import tempfile
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from flask import current_app
+
+from app.models.documents import BlobRef
+from app.storage.base import FileSource, LocalFileSource
+
+MAX_BYTES = 1024 * 1024 * 1024  # Default byte budget of the cache (see settings.toml: file_cache_max_bytes)
+MAX_AGE_TEMPORARY = 60 * 60  # Age after which a temporary file is considered abandoned (eg. by a killed worker)
+
+
+class FileCache:
+    """Cache of blobs in a local directory, each file named after its reference, eg. "gridfs-<key>"."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, blob_ref: BlobRef) -> LocalFileSource | None:
+        """Return the cached copy of the blob specified (if we have one), already open.
+
+        We hold the file open (rather than just its path) as another process may evict it from the
+        cache at any time, ie. before we've finished reading it (ok as the open file remains readable).
+        """
+        path, path_meta = self._paths(blob_ref)
+        try:
+            metadata = json.loads(path_meta.read_text())
+            fh = path.open("rb")
+        except (OSError, ValueError):
+            return None
+        os.utime(fh.fileno())  # (ie. it's now our most recently used)
+        return LocalFileSource.factory(path, metadata, fh)
+
+    def filling(self, blob_ref: BlobRef, source: FileSource) -> FileSource:
+        """Return the source of the blob specified such that it's added to the cache as it's read (in its entirety)."""
+        if source.length > self.max_bytes:
+            return source
+        return FillingSource(self, blob_ref, source)
+
+    def add(self, blob_ref: BlobRef, source: FileSource, path_temp: Path) -> None:
+        """Add the (complete) temporary copy specified of the blob's source to the cache."""
+        path, path_meta = self._paths(blob_ref)
+        os.replace(path_temp, path)
+        self._write_atomic(path_meta, json.dumps(source.as_dict()).encode())
+        log.debug(f"Cached {blob_ref} ({source.length:,d} bytes)")
+        self.trim()
+
+    def remove(self, blob_ref: BlobRef) -> None:
+        """Remove the blob specified from the cache (if there)."""
+        self._remove(self._paths(blob_ref))
+
+    def _remove(self, paths: tuple[Path, Path]) -> None:
+        for path in reversed(paths):  # (metadata first, ie. "uncommit" it)
+            path.unlink(missing_ok=True)
+
+    def trim(self) -> None:
+        """Evict the least recently used files until we're within our byte budget (unless another process is)."""
+        with (self.directory / ".lock").open("w") as fh_lock:
+            try:
+                fcntl.flock(fh_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            entries, now = [], time.time()
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(".tmp-") and entry.stat().st_mtime < now - MAX_AGE_TEMPORARY:
+                    Path(entry.path).unlink(missing_ok=True)
+                elif not entry.name.startswith(".") and not entry.name.endswith(".json"):
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove((self.directory / name, self.directory / f"{name}.json"))
+                total -= size
+                log.debug(f"Evicted {name} from file cache ({size:,d} bytes)")
+
+    def temporary(self) -> tempfile._TemporaryFileWrapper:
+        """Return a new temporary file in the cache directory (ie. on the same filesystem, so we can rename it)."""
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix=".tmp-", delete=False)
+
+    def _paths(self, blob_ref: BlobRef) -> tuple[Path, Path]:
+        """Return the paths to the content and metadata of the blob specified."""
+        name = f"{blob_ref.store}-{blob_ref.key}"
+        return self.directory / name, self.directory / f"{name}.json"
+
+    def _write_atomic(self, path: Path, contents: bytes) -> None:
+        with self.temporary() as fh:
+            fh.write(contents)
+        os.replace(fh.name, path)
+
+
+class FillingSource(FileSource):
+    """A (remote) file which, when read in its entirety, is also written to the cache."""
+
+    def __init__(self, cache: FileCache, blob_ref: BlobRef, source: FileSource):
+        super().__init__(source.key, source.length, source.content_type, source.md5, source.upload_date)
+        self.cache = cache
+        self.blob_ref = blob_ref
+        self.source = source
+
+    def read(self, start: int, length: int) -> Iterator[bytes]:
+        return self.source.read(start, length)
+
+    def body(self, environ: dict) -> Iterable[bytes]:
+        """Yield the entire contents of the file, writing them to a temporary file to be added to the cache."""
+        fh = self.cache.temporary()
+        complete = False
+        try:
+            written = 0
+            for chunk in self.source.read(0, self.length):
+                fh.write(chunk)
+                written += len(chunk)
+                yield chunk
+            fh.close()
+            if complete := written == self.length:
+                self.cache.add(self.blob_ref, self, Path(fh.name))
+        finally:
+            fh.close()
+            if not complete:  # (eg. the client went away before we were done)
+                Path(fh.name).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self.source.close()
+
+
+################################################################################
+# Entry points
+################################################################################
+_CACHES: dict[str, FileCache] = {}
+
+
+def file_cache() -> FileCache | None:
+    """Return the file cache configured for the current application (or None if it's disabled)."""
+    if not (directory := current_app.config.get("FILE_CACHE_DIR")):
+        return None
+    if directory not in _CACHES:
+        max_bytes = current_app.config.get("FILE_CACHE_MAX_BYTES", MAX_BYTES)
+        _CACHES[directory] = FileCache(Path(directory).expanduser(), max_bytes)
+    return _CACHES[directory]
@@ -0,0 +1,82 @@
+"""Blob store in MongoDB's GridFS (ie. where all our files have lived to date)."""
+
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import gridfs
+from bson.objectid import ObjectId
+from gridfs.grid_file import GridOut
+from mongoengine.connection import get_db
+
+from app.models.documents import BlobRef
+from app.storage.base import BLOCK_SIZE, BlobStore, FileSource, HashingReader
+
+
+class GridFSStore(BlobStore):
+    """Blobs in GridFS, keyed by their GridFS id (the same bucket as our legacy Documents.file_ FileField)."""
+
+    name = "gridfs"
+
+    def __init__(self, collection: str = "fs"):
+        self.collection = collection
+
+    @property
+    def fs(self) -> gridfs.GridFS:
+        return gridfs.GridFS(get_db(), collection=self.collection)
+
+    def put(
+        self,
+        stream: BinaryIO,
+        filename: str | None,
+        content_type: str | None,
+        key: str | None = None,
+    ) -> BlobRef:
+        reader = HashingReader(stream)
+        _id = ObjectId(key) if key else ObjectId()
+        grid_in = self.fs.new_file(_id=_id, filename=filename, contentType=content_type)
+        with grid_in:
+            while block := reader.read(BLOCK_SIZE):
+                grid_in.write(block)
+        return BlobRef(
+            store=self.name,
+            key=str(grid_in._id),
+            length=reader.length,
+            content_type=content_type,
+            filename=filename,
+            md5=reader.md5,
+            sha256=reader.sha256,
+            uploaded=grid_in.upload_date.replace(tzinfo=None),
+        )
+
+    def open(self, blob_ref: BlobRef) -> FileSource:
+        return GridFileSource(self.fs.get(ObjectId(blob_ref.key)), blob_ref)
+
+    def delete(self, blob_ref: BlobRef) -> None:
+        self.fs.delete(ObjectId(blob_ref.key))
+
+    def delete_many(self, blob_refs: list[BlobRef]) -> None:
+        """Delete all the blobs specified with a single delete of their files and one of all their chunks."""
+        ids = [ObjectId(blob_ref.key) for blob_ref in blob_refs]
+        db = get_db()
+        db[f"{self.collection}.files"].delete_many({"_id": {"$in": ids}})
+        db[f"{self.collection}.chunks"].delete_many({"files_id": {"$in": ids}})
+
+
+class GridFileSource(FileSource):
+    """A file read directly from GridFS."""
+
+    def __init__(self, grid_out: GridOut, blob_ref: BlobRef):
+        super().__init__(**self.metadata(blob_ref))
+        self.grid_out = grid_out
+
+    def read(self, start: int, length: int) -> Iterator[bytes]:
+        """Yield length bytes of the file from start, seeking directly to the GridFS chunk holding it."""
+        remaining = length
+        self.grid_out.seek(start)
+        while remaining > 0 and (chunk := self.grid_out.readchunk()):
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        self.grid_out.close()
@@ -0,0 +1,70 @@
+"""Blob store on the local filesystem (ie. no bytes in, or billed by, the database)."""
+
+import datetime as dt
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from bson.objectid import ObjectId
+
+from app.models.documents import BlobRef
+from app.storage.base import BLOCK_SIZE, BlobStore, FileSource, HashingReader, LocalFileSource
+
+
+class LocalStore(BlobStore):
+    """Blobs in a local directory, fanned out over sub-directories by the end of their key, eg. <root>/f3/<key>."""
+
+    name = "local"
+    is_local = True
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(
+        self,
+        stream: BinaryIO,
+        filename: str | None,
+        content_type: str | None,
+        key: str | None = None,
+    ) -> BlobRef:
+        """Store the stream, ie. write it to a temporary file and atomically move it into place once complete."""
+        key = key or str(ObjectId())
+        reader = HashingReader(stream)
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix=".tmp-", delete=False) as fh:
+            try:
+                while block := reader.read(BLOCK_SIZE):
+                    fh.write(block)
+                fh.flush()
+                os.fsync(fh.fileno())
+            except BaseException:
+                Path(fh.name).unlink(missing_ok=True)  # (ie. don't leave a partial file behind)
+                raise
+        path = self.path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            os.replace(fh.name, path)
+        except OSError:
+            Path(fh.name).unlink(missing_ok=True)
+            raise
+        return BlobRef(
+            store=self.name,
+            key=key,
+            length=reader.length,
+            content_type=content_type,
+            filename=filename,
+            md5=reader.md5,
+            sha256=reader.sha256,
+            uploaded=dt.datetime.utcnow(),
+        )
+
+    def open(self, blob_ref: BlobRef) -> FileSource:
+        return LocalFileSource(self.path(blob_ref.key), **FileSource.metadata(blob_ref))
+
+    def delete(self, blob_ref: BlobRef) -> None:
+        self.path(blob_ref.key).unlink(missing_ok=True)
+
+    def path(self, key: str) -> Path:
+        """Return the path to the blob with the key specified."""
+        return self.root / key[-2:] / key
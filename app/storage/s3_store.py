@@ -0,0 +1,86 @@
+"""Blob store in an S3-compatible object store (eg. AWS S3, Cloudflare R2 or a local MinIO).
+
+Requires the (optional) boto3 package, ie. poetry install --extras s3; credentials are taken from
+the usual AWS environment variables/configuration.
+"""
+
+import datetime as dt
+from collections.abc import Iterator
+from typing import BinaryIO
+
+from bson.objectid import ObjectId
+
+from app.models.documents import BlobRef
+from app.storage.base import BLOCK_SIZE, BlobStore, FileSource, HashingReader
+
+MAX_DELETE = 1000  # Most objects S3 deletes in a single request.
+
+
+class S3Store(BlobStore):
+    """Blobs as objects in an S3 bucket, named <prefix><key>."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None):
+        import boto3  # (optional dependency, ie. only needed if we're actually using S3)
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def put(
+        self,
+        stream: BinaryIO,
+        filename: str | None,
+        content_type: str | None,
+        key: str | None = None,
+    ) -> BlobRef:
+        key = key or str(ObjectId())
+        reader = HashingReader(stream)
+        extra_args = {"ContentType": content_type} if content_type else {}
+        self.client.upload_fileobj(reader, self.bucket, self.prefix + key, ExtraArgs=extra_args)
+        return BlobRef(
+            store=self.name,
+            key=key,
+            length=reader.length,
+            content_type=content_type,
+            filename=filename,
+            md5=reader.md5,
+            sha256=reader.sha256,
+            uploaded=dt.datetime.utcnow(),
+        )
+
+    def open(self, blob_ref: BlobRef) -> FileSource:
+        return S3FileSource(self, blob_ref)
+
+    def delete(self, blob_ref: BlobRef) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + blob_ref.key)
+
+    def delete_many(self, blob_refs: list[BlobRef]) -> None:
+        """Delete all the blobs specified, ie. up to MAX_DELETE objects per request."""
+        keys = [{"Key": self.prefix + blob_ref.key} for blob_ref in blob_refs]
+        for start in range(0, len(keys), MAX_DELETE):
+            self.client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": keys[start : start + MAX_DELETE], "Quiet": True}
+            )
+
+
+class S3FileSource(FileSource):
+    """A file read from S3, ie. with a ranged GET for each range requested (metadata comes from the BlobRef)."""
+
+    def __init__(self, store: S3Store, blob_ref: BlobRef):
+        super().__init__(**self.metadata(blob_ref))
+        self.store = store
+
+    def read(self, start: int, length: int) -> Iterator[bytes]:
+        if length <= 0:
+            return
+        response = self.store.client.get_object(
+            Bucket=self.store.bucket,
+            Key=self.store.prefix + self.key,
+            Range=f"bytes={start}-{start + length - 1}",
+        )
+        try:
+            yield from response["Body"].iter_chunks(BLOCK_SIZE)
+        finally:
+            response["Body"].close()